@@ -0,0 +1,11 @@
+from config import *
+from utils.MimickNet_Dataset import MimickDataset
+
+# Build once per preprocessing config (--clipping, --in_h, --in_w, --crop_mode), then train with the same --cache_dir
+if config.cache_dir is None:
+  raise ValueError('--cache_dir is required')
+
+mimick = MimickDataset.from_config(config)
+
+for dataset_type in ['train', 'validation', 'test']:
+  mimick.build_cache(dataset_type, num_shards=config.num_shards)
@@ -17,14 +17,10 @@ limitations under the License.
 import argparse
 import csv
 import tensorflow as tf
-import numpy as np
-from skimage.exposure import match_histograms
-from trainer import utils
-import sys
+from utils.export import custom_pad, custom_depad
+from utils.frame_store import FrameStore, load_mat_frame
+from utils.inference_accuracy import evaluate_batch
 import pandas as pd
-import scipy.io as sio
-
-from multiprocessing import Pool
 
 _FIELDNAMES = ['filename', 'mse', 'mae', 'ssim', 'contrast_structure', 'luminance', 'psnr', 'corr',
                'iq_mse', 'iq_mae', 'iq_ssim', 'iq_contrast_structure', 'iq_luminance', 'iq_psnr', 'iq_corr',
@@ -34,70 +30,27 @@ _FIELDNAMES = ['filename', 'mse', 'mae', 'ssim', 'contrast_structure', 'luminanc
 
 class GetCsvMetrics(tf.keras.callbacks.Callback):
     def __init__(self, forward, dataset_csvpath, job_dir, out='metrics',
-                 bucket='gs://duke-research-us/mimicknet/data/duke-ultrasound-v1', clip=-80):
+                 bucket='gs://duke-research-us/mimicknet/data/duke-ultrasound-v1', clip=-80, frame_store=None):
         super().__init__()
         self.df = pd.read_csv(tf.io.gfile.GFile(dataset_csvpath, 'rb'))
         self.forward = forward
         self.csv_out_filepath = tf.io.gfile.GFile('{}/{}.csv'.format(job_dir, out), 'wb')
         self.bucket = bucket
         self.clip = clip
+        self.frame_store = FrameStore(frame_store) if isinstance(frame_store, str) else frame_store
+        if self.frame_store is not None and self.frame_store.clip != clip:
+            raise ValueError('Frame store was built with clip {}, not {}'.format(self.frame_store.clip, clip))
         
-    def get_metrics(self, x, y):
-        corr = np.corrcoef(x.flatten(), y.flatten())[0][1]
-        
-        x = tf.constant(x[:,:,None], dtype=tf.float32)
-        y = tf.constant(y[:,:,None], dtype=tf.float32)
-        
-        psnr = tf.image.psnr(x, y, 1)
-        val, cs, l = utils.custom_ssim.ssim(x, y, 1)
-
-        return {
-            'mse': tf.math.reduce_mean(tf.math.square((x - y))).numpy(),
-            'mae': tf.math.reduce_mean(tf.math.abs((x - y))).numpy(),
-            'ssim': val.numpy(),
-            'contrast_structure': cs.numpy(),
-            'luminance': l.numpy(),
-            'psnr': psnr.numpy(),
-            'corr': corr
-        }
-
     def get_ele(self, ele, iq_key='iq', dtce_key='dtce'):
-        # Get images
-        matfile = sio.loadmat(tf.io.gfile.GFile('{}/{}'.format(self.bucket, ele['filename']), 'rb'))
-        iq = np.abs(matfile[iq_key])
-        iq = 20*np.log10(iq/iq.max())
-        iq = np.clip(iq, self.clip, 0)
-        iq = (iq - iq.min())/(iq.max()-iq.min())
-        dtce = (matfile[dtce_key] - matfile[dtce_key].min())/(matfile[dtce_key].max()-matfile[dtce_key].min())
-        ele['das'] = iq
-        ele['dtce'] = dtce
-        output = self.forward.predict(iq[None, :, :, None])
-        ele['output'] = np.squeeze(output[0])
-        return ele
+        # Get a (filename, das, dtce) frame, from the memory-mapped store when available
+        if self.frame_store is not None and ele['filename'] in self.frame_store:
+            return (ele['filename'],) + self.frame_store.get(ele['filename'])
+        return load_mat_frame((ele['filename'], self.bucket, self.clip, iq_key, dtce_key))
 
     def full_validation(self):
+        # Same metric definitions as utils/inference_accuracy.py, one frame at a time
         for i, row in self.df.iterrows():
-            ele = self.get_ele(row)
-            tmp = {}
-            dtce_metrics = self.get_metrics(ele['dtce'], ele['output'])
-            iq_metrics = self.get_metrics(ele['dtce'], ele['das'])
-            for key, value in iq_metrics.items():
-                tmp['iq_{}'.format(key)] = value
-            for key, value in dtce_metrics.items():
-                tmp['{}'.format(key)] = value
-
-            dtce = match_histograms(ele['dtce'], ele['das'])
-            output = match_histograms(ele['output'], ele['das'])
-            dtce_metrics = self.get_metrics(dtce, output)
-            iq_metrics = self.get_metrics(dtce, output)
-            for key, value in iq_metrics.items():
-                tmp['hm_iq_{}'.format(key)] = value
-            for key, value in dtce_metrics.items():
-                tmp['hm_{}'.format(key)] = value
-                
-
-            tmp['filename'] = row.filename
-            self.writer.writerow(tmp)
+            self.writer.writerows(evaluate_batch(self.forward, [self.get_ele(row)]))
             print('{}/{} - {}'.format(i, len(self.df), row.filename))
 
     def on_train_end(self, logs={}):
@@ -108,24 +61,6 @@ class GetCsvMetrics(tf.keras.callbacks.Callback):
         self.full_validation()
         self.csv_out_filepath.flush()
         
-def custom_pad(inputs):
-    shape = tf.shape(inputs)
-    height_pad = (16 - shape[1] % 16)
-    width_pad = (16 - shape[2] % 16)
-    padded = tf.pad(inputs, [[0,0],
-                           [0,height_pad],
-                           [0,width_pad],
-                           [0,0]], mode='REFLECT')
-    return padded
-
-def custom_depad(inputs):
-    original = inputs[0]
-    final = inputs[1]
-    shape = tf.shape(original)
-    final = final[:, :shape[1], :shape[2], :]
-    final = tf.clip_by_value(final, 0, 1)
-    return final
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--forward', default='./examples/models/mimicknet_1568473738-210304.h5',
@@ -134,6 +69,7 @@ if __name__ == '__main__':
     parser.add_argument('--csv', default='gs://duke-research-us/mimicknet/data/testing-v2.csv')
     parser.add_argument('--out', default='mimicknet_1568473738-210304_metrics', help='Metrics ouptut filepath')
     parser.add_argument('--clip', type=int, default=-80)
+    parser.add_argument('--frame_store', default=None, help='Memory-mapped frame store built by utils/frame_store.py')
     
     args = parser.parse_args()
 
@@ -144,6 +80,7 @@ if __name__ == '__main__':
     x = tf.keras.layers.Lambda(custom_depad)([inputs, x])
     model = tf.keras.Model(inputs,x)
 
-    get_csv_metrics_data_callback = GetCsvMetrics(model, args.csv, args.job_dir, out=args.out)
+    get_csv_metrics_data_callback = GetCsvMetrics(model, args.csv, args.job_dir, out=args.out,
+                                                  clip=args.clip, frame_store=args.frame_store)
     get_csv_metrics_data_callback.on_train_end()
 
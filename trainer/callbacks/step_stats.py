@@ -0,0 +1,34 @@
+import time
+import numpy as np
+import tensorflow as tf
+from utils.inference_speed import peak_rss_mb
+
+class StepStats(tf.keras.callbacks.Callback):
+    """Logs the median training step time and peak memory every epoch, to compare precisions and trainers.
+    Peak memory is the device allocator peak on GPU and the process peak RSS on CPU."""
+    def __init__(self, skip_steps=5):
+        super().__init__()
+        self.skip_steps = skip_steps
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.step_times = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.t_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_times.append(time.perf_counter() - self.t_start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        # The first steps include tracing and compilation
+        step_times = self.step_times[self.skip_steps:] or self.step_times
+        logs = logs if logs is not None else {}
+        logs['step_ms'] = float(np.median(step_times) * 1000)
+        logs['peak_memory_mb'] = peak_memory_mb()
+        print('\nprecision {} - step {:.1f} ms - peak memory {:.0f} MB'.format(
+            tf.keras.mixed_precision.global_policy().name, logs['step_ms'], logs['peak_memory_mb']))
+
+def peak_memory_mb():
+    if tf.config.list_physical_devices('GPU'):
+        return tf.config.experimental.get_memory_info('GPU:0')['peak'] / 2**20
+    return peak_rss_mb()
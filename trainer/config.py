@@ -28,6 +28,13 @@ def get_config():
     parser.add_argument('--m',        default=True, type=bool, help='manual run or hp tuning')
     parser.add_argument('--is_test',  default=False, type=bool, help='is test')
 
+    parser.add_argument('--crop_mode', default='fixed', choices=['fixed', 'random'], help='training patch placement')
+    parser.add_argument('--patches_per_image', default=1, type=int, help='training patches drawn per image')
+
+    parser.add_argument('--bucket_step', default=None, type=int, help='batch test frames in shape buckets of this multiple of 16 instead of one by one')
+    parser.add_argument('--cache_dir', default=None, help='directory of preprocessed dataset shards, see build_dataset_cache.py')
+    parser.add_argument('--num_shards', default=16, type=int, help='shards per split when building the dataset cache')
+
     parser.add_argument('--train_csv', default='gs://duke-research-us/mimicknet/data/training-v2.csv', help='csv for paired training')
     parser.add_argument('--train_das_csv', default='gs://duke-research-us/mimicknet/data/training_a-v2.csv', help='csv with das images for training')
     parser.add_argument('--train_clinical_csv', default='gs://duke-research-us/mimicknet/data/training_b-v2.csv', help='csv with clinical images for training')
@@ -37,8 +44,62 @@ def get_config():
     # Modeling parser
     parser.add_argument('--clipping', default=-80.0, type=float, help='DAS dB clipping')
     parser.add_argument('--kernel_height', default=3, type=int, help='height of convolution kernel')
+    parser.add_argument('--precision', default='float32', choices=['float32', 'mixed_float16', 'mixed_bfloat16'], help='Keras precision policy, mixed_bfloat16 suits CPU hosts')
     parser.add_argument('--cycle_consistency_loss', default=10, type=int, help='cycle consistency loss weight')
   
+    # Distributed training parser
+    parser.add_argument('--strategy', default='default', choices=['default', 'mirrored', 'multi_worker'], help='tf.distribute strategy, multi_worker reads the cluster from TF_CONFIG')
+
+    # Custom training loop parser
+    parser.add_argument('--trainer', default='loop', choices=['loop', 'fit'], help='XLA compiled custom loop, or model.fit to compare step times')
+    parser.add_argument('--accum_steps', default=1, type=int, help='batches of gradients summed per optimizer update in the custom loop')
+    parser.add_argument('--no_jit', default=False, action='store_true', help='run the custom loop without XLA compilation, XLA CPU convolutions can be slower than the default oneDNN kernels')
+
+    # Distillation parser
+    parser.add_argument('--teacher', default='../example_models/model_noSC_Conv_v1.h5', help='trained .h5 teacher for distillation')
+    parser.add_argument('--student_type', default='SepConv', choices=['Conv', 'SepConv'], help='student convolution type')
+    parser.add_argument('--student_filters', default=[8, 8, 8], nargs='+', type=int, help='student filters per level, its length sets the levels')
+    parser.add_argument('--distill_alpha', default=0.5, type=float, help='weight of the dtce loss, the teacher output gets the rest')
+    parser.add_argument('--feature_weight', default=1.0, type=float, help='weight of the teacher attention map loss')
+    parser.add_argument('--teacher_cache', default=None, help='path of a cached teacher-output store, built on first use')
+    parser.add_argument('--teacher_cache_steps', default=500, type=int, help='training batches written to the teacher cache')
+
+    # Channel pruning parser
+    parser.add_argument('--prune_model', default='../example_models/model_noSC_Conv_v1.h5', help='trained .h5 to prune')
+    parser.add_argument('--target_flops', default=0.5, type=float, help='pruned FLOPs as a fraction of the original')
+    parser.add_argument('--target_ms', default=None, type=float, help='TFLite latency budget at --in_h x --in_w, overrides --target_flops')
+    parser.add_argument('--prune_fraction', default=0.05, type=float, help='fraction of the remaining channels removed per pruning step')
+    parser.add_argument('--min_channels', default=2, type=int, help='channels every pruned layer keeps')
+    parser.add_argument('--prune_epochs', default=2, type=int, help='fine-tuning epochs after pruning')
+    parser.add_argument('--prune_steps', default=200, type=int, help='fine-tuning steps per epoch')
+    parser.add_argument('--prune_val_steps', default=50, type=int, help='validation steps for the before / after SSIM')
+
+    # Quantization-aware training parser
+    parser.add_argument('--qat', default=False, action='store_true', help='fine-tune a trained model with fake-quant nodes and export int8 TFLite')
+    parser.add_argument('--qat_model', default='../example_models/model_noSC_Conv_v1.h5', help='trained .h5 to fine-tune with quantization-aware training')
+    parser.add_argument('--qat_epochs', default=5, type=int, help='quantization-aware fine-tuning epochs')
+    parser.add_argument('--qat_lr', default=0.0001, type=float, help='quantization-aware fine-tuning learning rate')
+
+    # Export parser
+    parser.add_argument('--model_pwd', default='trained_models/model_noSC_Conv_v1', help='model path without extension for TFLite export')
+    parser.add_argument('--export', default='model', choices=['model', 'bmode'], help='export the bare model or the full DAS to scan converted B-mode graph')
+
+    parser.add_argument('--mode', default=['dynamic', 'float16', 'int8', 'int8_full'], nargs='+', choices=['dynamic', 'float16', 'int8', 'int8_full'], help='post-training quantization modes to export')
+    parser.add_argument('--rep_samples', default=100, type=int, help='representative frames for int8 calibration')
+    parser.add_argument('--eval_samples', default=32, type=int, help='validation frames for quantization report')
+
+    # Architecture sweep parser
+    parser.add_argument('--sweep_conv_types', default=['Conv', 'SepConv'], nargs='+', choices=['Conv', 'SepConv'], help='convolution types to sweep')
+    parser.add_argument('--sweep_filters', default=[8, 16, 32], nargs='+', type=int, help='filters per level to sweep')
+    parser.add_argument('--sweep_kernels', default=[3, 5], nargs='+', type=int, help='square kernel sizes to sweep')
+    parser.add_argument('--sweep_levels', default=5, type=int, help='U-Net levels of every sweep candidate')
+    parser.add_argument('--sweep_epochs', default=2, type=int, help='training epochs per sweep candidate')
+    parser.add_argument('--sweep_steps', default=200, type=int, help='training steps per sweep epoch')
+    parser.add_argument('--sweep_val_steps', default=50, type=int, help='validation steps scoring a sweep candidate')
+    parser.add_argument('--sweep_workers', default=2, type=int, help='candidates trained in parallel processes')
+    parser.add_argument('--sweep_dir', default='trained_models/sweep', help='directory for sweep models and results')
+    parser.add_argument('--ssim_floor', default=None, type=float, help='pick the fastest sweep candidate with at least this validation SSIM')
+
     # Cloud ML Params
     parser.add_argument('--job-dir', default='gs://duke-research-us/mimicknet/tmp/{}'.format(str(time.time())), help='Job directory for Google Cloud ML')
     parser.add_argument('--model_dir', default='./trained_models', help='Directory for trained models')
@@ -6,11 +6,13 @@ class MimickNet_Conv():
     def __init__(self, shape=(None, None, 1),
                    Activation=tf.keras.layers.ReLU(),
                    filters=[16, 16, 16, 16, 16],
-                   filter_shape=(3, 3)):
+                   filter_shape=(3, 3),
+                   scan_convert=False):
         self.shape = shape
         self.Activation = Activation
         self.filters = filters
         self.filter_shape = filter_shape
+        self.scan_convert = scan_convert
         
     def load_model(self):
         inputs = Input(shape=self.shape)
@@ -43,4 +45,15 @@ class MimickNet_Conv():
 
         x = Conv2D(1, 1)(x)
 
+        # Under a mixed precision policy the output goes back to float32, so losses and metrics see float32
+        if tf.keras.mixed_precision.global_policy().compute_dtype != 'float32':
+          x = Activation('linear', dtype='float32')(x)
+
+        # Append scan conversion so model and fan-out run as one graph
+        if self.scan_convert:
+          from utils.scan_convert import ScanConvert
+          geometry = Input(shape=(4,))
+          x = ScanConvert()([x, geometry])
+          return Model([inputs, geometry], x)
+
         return Model(inputs, x)
\ No newline at end of file
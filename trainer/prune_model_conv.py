@@ -0,0 +1,65 @@
+import os
+import json
+import tensorflow as tf
+from config import *
+from utils import losses
+from utils.MimickNet_Dataset import MimickDataset
+from utils.prune import prune_to_budget
+from utils.profiler import model_flops, time_call, profile_tflite
+from utils.tflite import convert_tflite
+
+# Load Dataset
+mimick = MimickDataset.from_config(config)
+
+train_dataset = mimick.make_dataset(dataset_type='train')
+validation_dataset = mimick.make_dataset(dataset_type='validation')
+
+def measure(model):
+  ''' FLOPs, single frame latency and validation SSIM at the training input size '''
+  model.compile(loss='mae', metrics=[losses.ssim])
+  results = model.evaluate(validation_dataset, steps=config.prune_val_steps, return_dict=True, verbose=0)
+  image = tf.random.uniform((1, config.in_h, config.in_w, 1))
+  return {'params': int(model.count_params()),
+          'gflops': model_flops(model, config.in_h, config.in_w) / 1e9,
+          'keras_ms': time_call(tf.function(model), (image,)),
+          'tflite_ms': profile_tflite(model, config.in_h, config.in_w)[0],
+          'val_mae': float(results['loss']),
+          'val_ssim': float(results['ssim'])}
+
+# Load Model
+# Reset tf session
+tf.keras.backend.clear_session()
+model = tf.keras.models.load_model(config.prune_model, compile=False)
+before = measure(model)
+
+# Prune to the latency budget if one is given, else to the FLOP fraction
+if config.target_ms is not None:
+  cost_fn, target = lambda m: profile_tflite(m, config.in_h, config.in_w)[0], config.target_ms
+else:
+  cost_fn, target = lambda m: model_flops(m, config.in_h, config.in_w) / 1e9 / before['gflops'], config.target_flops
+pruned, kept = prune_to_budget(model, cost_fn, target, config.prune_fraction, config.min_channels)
+
+# Fine-tune the surviving channels briefly
+pruned.compile(optimizer=tf.keras.optimizers.Adam(0.0005), loss='mae',
+               metrics=[losses.mae, losses.mse, losses.ssim, losses.psnr])
+pruned.fit(train_dataset,
+           steps_per_epoch=config.prune_steps,
+           epochs=config.prune_epochs,
+           validation_data=validation_dataset,
+           validation_steps=config.prune_val_steps,
+           verbose=1)
+after = measure(pruned)
+
+# Save model
+model_pwd = "trained_models/{}_pruned".format(os.path.splitext(os.path.basename(config.prune_model))[0])
+pruned.save(f"{model_pwd}.h5")
+with open(f"{model_pwd}.tflite", 'wb') as f:
+  f.write(convert_tflite(pruned))
+
+report = {'model': config.prune_model, 'height': config.in_h, 'width': config.in_w,
+          'channels': {name: len(indices) for name, indices in kept.items()},
+          'before': before, 'after': after}
+with open(f"{model_pwd}_report.json", 'w') as f:
+  json.dump(report, f, indent=2)
+for key in before:
+  print('{}: {:.4f} -> {:.4f}'.format(key, before[key], after[key]))
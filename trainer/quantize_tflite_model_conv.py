@@ -0,0 +1,66 @@
+import time
+import json
+import numpy as np
+import tensorflow as tf
+from config import *
+from utils import losses
+from utils.tflite import convert_tflite, make_representative_dataset, run_tflite, load_interpreter
+from utils.MimickNet_Dataset import MimickDataset
+
+model_pwd = config.model_pwd
+
+# Load Dataset
+mimick = MimickDataset.from_config(config)
+validation_dataset = mimick.make_dataset(dataset_type='validation')
+
+# Load model
+# Reset tf session
+tf.keras.backend.clear_session()
+model = tf.keras.models.load_model(f"{model_pwd}.h5", compile=False)
+
+# Fixed evaluation frames
+eval_das, eval_dtce = [], []
+for das, dtce in validation_dataset.unbatch().take(config.eval_samples):
+  eval_das.append(das.numpy())
+  eval_dtce.append(dtce.numpy())
+
+def evaluate(tflite_model):
+  interpreter = load_interpreter(tflite_model)
+  run_tflite(interpreter, eval_das[0][None])  # warm-up
+  outputs, latencies = [], []
+  for das in eval_das:
+    t0 = time.perf_counter()
+    outputs.append(run_tflite(interpreter, das[None])[0])
+    latencies.append(time.perf_counter() - t0)
+  outputs = np.stack(outputs)
+  dtce = np.stack(eval_dtce)
+  return outputs, {
+    'size_bytes': len(tflite_model),
+    'latency_ms': 1000*float(np.median(latencies)),
+    'ssim': float(tf.reduce_mean(losses.ssim(dtce, outputs))),
+    'psnr': float(tf.reduce_mean(losses.psnr(dtce, outputs))),
+  }
+
+# Float32 baseline
+baseline = convert_tflite(model, 'float32')
+baseline_outputs, baseline_report = evaluate(baseline)
+report = {'float32': baseline_report}
+
+# Quantized variants
+representative_dataset = make_representative_dataset(validation_dataset, config.rep_samples)
+for mode in config.mode:
+  tflite_model = convert_tflite(model, mode, representative_dataset)
+  with open(f"{model_pwd}_{mode}.tflite", 'wb') as f:
+    f.write(tflite_model)
+
+  outputs, result = evaluate(tflite_model)
+  result['size_ratio'] = result['size_bytes'] / baseline_report['size_bytes']
+  result['speedup'] = baseline_report['latency_ms'] / result['latency_ms']
+  result['ssim_delta'] = result['ssim'] - baseline_report['ssim']
+  result['psnr_delta'] = result['psnr'] - baseline_report['psnr']
+  result['ssim_vs_float32'] = float(tf.reduce_mean(losses.ssim(baseline_outputs, outputs)))
+  report[mode] = result
+  print(mode, result)
+
+with open(f"{model_pwd}_quantization.json", 'w') as f:
+  json.dump(report, f, indent=2)
@@ -0,0 +1,87 @@
+import os
+import csv
+import itertools
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from config import *
+from utils import losses
+from utils.MimickNet_Dataset import MimickDataset
+from utils.profiler import build_model, time_call, profile_tflite
+
+_FIELDNAMES = ['name', 'conv_type', 'filters', 'kernel', 'params', 'val_mae', 'val_ssim',
+               'keras_ms', 'tflite_ms', 'pareto', 'model_path']
+
+
+def train_candidate(candidate):
+  ''' Trains one grid point for the short sweep budget, meant to run in a fresh process '''
+  conv_type, filters, kernel, threads = candidate
+  tf.config.threading.set_intra_op_parallelism_threads(threads)
+  mimick = MimickDataset.from_config(config)
+  train_dataset = mimick.make_dataset(dataset_type='train')
+  validation_dataset = mimick.make_dataset(dataset_type='validation')
+
+  model = build_model(conv_type, [filters]*config.sweep_levels, (kernel, kernel))
+  model.compile(optimizer=tf.keras.optimizers.Adam(0.002), loss='mae', metrics=[losses.ssim])
+  model.fit(train_dataset, steps_per_epoch=config.sweep_steps, epochs=config.sweep_epochs, verbose=2)
+  results = model.evaluate(validation_dataset, steps=config.sweep_val_steps, return_dict=True, verbose=0)
+
+  name = '{}_f{}_k{}'.format(conv_type, filters, kernel)
+  model_path = os.path.join(config.sweep_dir, '{}.h5'.format(name))
+  model.save(model_path)
+  return {'name': name, 'conv_type': conv_type, 'filters': filters, 'kernel': kernel,
+          'params': int(model.count_params()), 'val_mae': float(results['loss']),
+          'val_ssim': float(results['ssim']), 'model_path': model_path}
+
+
+def measure_latency(row):
+  ''' Single frame CPU latency at the configured input size, Keras and TFLite '''
+  model = tf.keras.models.load_model(row['model_path'], compile=False)
+  image = tf.random.uniform((1, config.in_h, config.in_w, 1))
+  row['keras_ms'] = time_call(tf.function(model), (image,))
+  row['tflite_ms'], _ = profile_tflite(model, config.in_h, config.in_w)
+  return row
+
+
+def pareto_front(rows, latency_key='tflite_ms'):
+  ''' Candidates no other candidate beats on both latency and validation SSIM '''
+  front = []
+  best_ssim = -np.inf
+  for row in sorted(rows, key=lambda row: (row[latency_key], -row['val_ssim'])):
+    if row['val_ssim'] > best_ssim:
+      front.append(row)
+      best_ssim = row['val_ssim']
+  return front
+
+
+if __name__ == '__main__':
+  os.makedirs(config.sweep_dir, exist_ok=True)
+  threads = max(multiprocessing.cpu_count() // config.sweep_workers, 1)
+  grid = [(conv_type, filters, kernel, threads) for conv_type, filters, kernel
+          in itertools.product(config.sweep_conv_types, config.sweep_filters, config.sweep_kernels)]
+
+  # Candidates train in spawned processes, this one already holds a TensorFlow runtime.
+  # One task per process frees each model's memory.
+  with multiprocessing.get_context('spawn').Pool(config.sweep_workers, maxtasksperchild=1) as pool:
+    rows = pool.map(train_candidate, grid, chunksize=1)
+
+  # Latency is measured after training, one model at a time, so parallel training cannot skew it
+  rows = [measure_latency(row) for row in rows]
+  front = pareto_front(rows)
+  for row in rows:
+    row['pareto'] = row in front
+
+  with open(os.path.join(config.sweep_dir, 'sweep.csv'), 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=_FIELDNAMES)
+    writer.writeheader()
+    writer.writerows(sorted(rows, key=lambda row: row['tflite_ms']))
+
+  print('Pareto front, latency vs validation SSIM:')
+  for row in front:
+    print('  {name}: {tflite_ms:.1f} ms TFLite, {keras_ms:.1f} ms Keras, SSIM {val_ssim:.4f}'.format(**row))
+  if config.ssim_floor is not None:
+    passing = [row for row in front if row['val_ssim'] >= config.ssim_floor]
+    if passing:
+      print('Fastest with SSIM >= {}: {}'.format(config.ssim_floor, passing[0]['model_path']))
+    else:
+      print('No candidate reaches SSIM {}'.format(config.ssim_floor))
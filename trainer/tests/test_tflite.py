@@ -0,0 +1,43 @@
+""" Run from the trainer directory: python -m pytest tests """
+
+import numpy as np
+import tensorflow as tf
+from utils.tflite import convert_tflite, load_interpreter, run_tflite, ZeroCopyRunner
+
+SHAPE = (1, 32, 32, 1)
+
+
+def small_model():
+    inputs = tf.keras.layers.Input(shape=SHAPE[1:])
+    x = tf.keras.layers.Conv2D(4, 3, padding='same', activation='relu')(inputs)
+    outputs = tf.keras.layers.Conv2D(1, 1, activation='sigmoid')(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def representative_dataset():
+    rng = np.random.default_rng(0)
+    for _ in range(8):
+        yield [rng.uniform(size=SHAPE).astype(np.float32)]
+
+
+def test_zero_copy_runner_matches_run_tflite():
+    model = small_model()
+    image = np.random.default_rng(1).uniform(size=SHAPE).astype(np.float32)
+    for mode in ['float32', 'int8', 'int8_full']:
+        tflite_model = convert_tflite(model, mode, representative_dataset)
+        expected = run_tflite(load_interpreter(tflite_model), image)
+        runner = ZeroCopyRunner(load_interpreter(tflite_model), SHAPE)
+        np.testing.assert_allclose(runner(image), expected, atol=1e-6, err_msg=mode)
+
+
+def test_zero_copy_runner_int8_output_does_not_wrap():
+    # A sigmoid output quantizes with zero point -128, so every output of 0.5 and above
+    # overflows if the zero point is subtracted in int8
+    model = small_model()
+    model.layers[-1].set_weights([np.zeros((1, 1, 4, 1), np.float32), np.full(1, 2.0, np.float32)])
+    tflite_model = convert_tflite(model, 'int8_full', representative_dataset)
+    runner = ZeroCopyRunner(load_interpreter(tflite_model), SHAPE)
+    assert runner.output_details['quantization'][1] == -128
+
+    output = runner(np.zeros(SHAPE, np.float32))
+    np.testing.assert_allclose(output, 1 / (1 + np.exp(-2.0)), atol=1 / 128)
@@ -0,0 +1,59 @@
+import tensorflow as tf
+from config import *
+from utils.precision import set_precision, make_optimizer
+from utils.profiler import build_model, time_call
+from utils.distill import Distiller, shared_skips, build_teacher_cache, load_teacher_cache
+from utils.MimickNet_Dataset import MimickDataset
+from callbacks.step_stats import StepStats
+
+# Load Dataset
+mimick = MimickDataset.from_config(config)
+
+# Information taken from https://www.tensorflow.org/datasets/catalog/duke_ultrasound
+train_count = 2556 * config.bs/2
+val_count = 278 * config.bs/2
+
+train_dataset = mimick.make_dataset(dataset_type='train')
+validation_dataset = mimick.make_dataset(dataset_type='validation')
+
+# Load Models
+# Reset tf session
+tf.keras.backend.clear_session()
+set_precision(config.precision)
+
+teacher = tf.keras.models.load_model(config.teacher, compile=False)
+teacher.trainable = False
+student = build_model(config.student_type, config.student_filters, (config.kernel_height, config.kernel_height))
+num_skips = shared_skips(student, teacher)
+
+# The teacher runs on the fly, or once into a store of soft targets and attention maps
+if config.teacher_cache:
+  if config.crop_mode == 'random':
+    print('Warning: the teacher cache replays the first {} random crops'.format(config.teacher_cache_steps))
+  build_teacher_cache(teacher, train_dataset, config.teacher_cache, config.teacher_cache_steps, num_skips)
+  train_dataset = load_teacher_cache(config.teacher_cache)
+
+# Validation batches carry no cached targets, the teacher scores them on the fly
+distiller = Distiller(student, teacher, num_skips=num_skips,
+                      alpha=config.distill_alpha, feature_weight=config.feature_weight)
+
+distiller.compile(optimizer=make_optimizer(0.002, config.precision))
+
+# Fit model
+distiller.fit(train_dataset,
+              steps_per_epoch=int(train_count/config.bs),
+              epochs=int(config.epochs/5),
+              validation_data=validation_dataset,
+              validation_steps=int(val_count/config.bs),
+              callbacks=[StepStats()],
+              verbose=1)
+
+# Save the student alone
+student_name = 'student_{}_{}'.format(config.student_type, '_'.join(str(f) for f in config.student_filters))
+student.save("trained_models/{}.h5".format(student_name))
+
+image = tf.random.uniform((1, config.in_h, config.in_w, 1))
+teacher_ms = time_call(tf.function(teacher), (image,))
+student_ms = time_call(tf.function(student), (image,))
+print('Teacher {} params {:.1f} ms, student {} params {:.1f} ms, {:.1f}x faster'.format(
+  teacher.count_params(), teacher_ms, student.count_params(), student_ms, teacher_ms / student_ms))
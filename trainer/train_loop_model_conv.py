@@ -0,0 +1,48 @@
+import tensorflow as tf
+from config import *
+from utils import losses
+from utils.precision import set_precision, make_optimizer
+from utils.train_loop import Trainer
+from utils.MimickNet_Dataset import MimickDataset
+from models.MimickNet_Conv import MimickNet_Conv
+from callbacks.step_stats import StepStats
+
+# Load Dataset
+mimick = MimickDataset.from_config(config)
+
+# Information taken from https://www.tensorflow.org/datasets/catalog/duke_ultrasound
+train_count = 2556 * config.bs/2
+val_count = 278 * config.bs/2
+
+train_dataset = mimick.make_dataset(dataset_type='train')
+validation_dataset = mimick.make_dataset(dataset_type='validation')
+
+# Load Model
+# Reset tf session
+tf.keras.backend.clear_session()
+set_precision(config.precision)
+
+model = MimickNet_Conv(shape=(None,None,1),Activation=tf.keras.layers.ReLU(),filters=[16,16,16,16,16], filter_shape=(3,3)).load_model()
+optimizer = make_optimizer(0.002, config.precision)
+
+# Fit model, --trainer fit runs the same budget through model.fit to compare step times
+if config.trainer == 'loop':
+  trainer = Trainer(model, optimizer, accum_steps=config.accum_steps, jit_compile=not config.no_jit)
+  trainer.fit(train_dataset,
+              steps_per_epoch=int(train_count/config.bs),
+              epochs=int(config.epochs/5),
+              validation_data=validation_dataset,
+              validation_steps=int(val_count/config.bs))
+else:
+  model.compile(optimizer=optimizer, loss='mae',
+                metrics=[losses.mae, losses.mse, losses.ssim, losses.psnr])
+  model.fit(train_dataset,
+            steps_per_epoch=int(train_count/config.bs),
+            epochs=int(config.epochs/5),
+            validation_data=validation_dataset,
+            validation_steps=int(val_count/config.bs),
+            callbacks=[StepStats()],
+            verbose=1)
+
+# Save model
+model.save("./trained_models/model_noSC_Conv_v1.h5")
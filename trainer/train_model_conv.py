@@ -1,37 +1,73 @@
+import os
 import tensorflow as tf
 from config import *
 from utils import losses
+from utils.precision import set_precision, make_optimizer
+from utils.distribute import make_strategy, shard_dataset, is_chief, worker_path
+from callbacks.step_stats import StepStats
 from utils.MimickNet_Dataset import MimickDataset
+from utils.inference_accuracy import evaluate_dataset
 from models.MimickNet_Conv import MimickNet_Conv
 
+# --bs is per replica, the global batch and learning rate grow with the replica count
+strategy = make_strategy(config.strategy)
+replicas = strategy.num_replicas_in_sync
+global_bs = config.bs * replicas
+
 # Load Dataset
-mimick = MimickDataset(divisible=16, bs=config.bs, dataset='duke_ultrasound', data_dir='gs://tfds-data/datasets')
+mimick = MimickDataset.from_config(config, bs=global_bs)
 
 # Information taken from https://www.tensorflow.org/datasets/catalog/duke_ultrasound
 train_count = 2556 * config.bs/2
 test_count = 438 * config.bs/2
 val_count = 278 * config.bs/2
+test_frames = 438
 
-train_dataset = mimick.make_dataset(dataset_type='train')
-validation_dataset = mimick.make_dataset(dataset_type='validation')
+train_dataset = shard_dataset(mimick.make_dataset(dataset_type='train'))
+validation_dataset = shard_dataset(mimick.make_dataset(dataset_type='validation'))
 test_dataset = mimick.make_dataset(dataset_type='test')
 
 # Load Model
 # Reset tf session
 tf.keras.backend.clear_session()
+set_precision(config.precision)
+
+if config.qat and config.precision != 'float32':
+  raise ValueError('Quantization-aware training runs in float32, drop --precision {}'.format(config.precision))
 
-model = MimickNet_Conv(shape=(None,None,1),Activation=tf.keras.layers.ReLU(),filters=[16,16,16,16,16], filter_shape=(3,3)).load_model()
+with strategy.scope():
+  if config.qat:
+    # Fine-tune an existing Conv or SepConv checkpoint with fake-quant nodes
+    from utils.qat import quantize_model
+    model = quantize_model(tf.keras.models.load_model(config.qat_model, compile=False))
+    learning_rate, epochs = config.qat_lr, config.qat_epochs
+  else:
+    model = MimickNet_Conv(shape=(None,None,1),Activation=tf.keras.layers.ReLU(),filters=[16,16,16,16,16], filter_shape=(3,3)).load_model()
+    learning_rate, epochs = 0.002, int(config.epochs/5)
 
-model.compile(optimizer=tf.keras.optimizers.Adam(0.002), loss='mae', 
-              metrics=[losses.mae, losses.mse, losses.ssim, losses.psnr])
+  model.compile(optimizer=make_optimizer(learning_rate * replicas, config.precision), loss='mae', 
+                metrics=[losses.mae, losses.mse, losses.ssim, losses.psnr])
 
 # Fit model
 model.fit(train_dataset,
-          steps_per_epoch=int(train_count/config.bs),
-          epochs=int(config.epochs/5),
+          steps_per_epoch=int(train_count/global_bs),
+          epochs=epochs,
           validation_data=validation_dataset,
-          validation_steps=int(val_count/config.bs),
+          validation_steps=int(val_count/global_bs),
+          callbacks=[StepStats()],
           verbose=1)
 
-# Save model
-model.save("trained_models/model_noSC_Conv_v1.h5")
\ No newline at end of file
+# Test metrics, frames run in shape bucket batches with --bucket_step
+if is_chief():
+  print('Test metrics:', evaluate_dataset(model, test_dataset, test_frames))
+
+# Save model, every worker saves but only the chief writes to trained_models
+if config.qat:
+  from utils.tflite import convert_tflite
+  model_pwd = "trained_models/{}_qat".format(os.path.splitext(os.path.basename(config.qat_model))[0])
+  model.save(worker_path(f"{model_pwd}.h5"))
+  if is_chief():
+    with open(f"{model_pwd}_int8.tflite", 'wb') as f:
+      f.write(convert_tflite(model, 'qat'))
+else:
+  model.save(worker_path("trained_models/model_noSC_Conv_v1.h5"))
\ No newline at end of file
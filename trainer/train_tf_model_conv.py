@@ -1,16 +1,20 @@
 import tensorflow as tf
 from config import *
 from utils import losses
+from utils.precision import set_precision, make_optimizer
+from callbacks.step_stats import StepStats
 from utils.MimickNet_Dataset import MimickDataset
+from utils.inference_accuracy import evaluate_dataset
 from models.MimickNet_Conv import MimickNet_Conv
 
 # Load Dataset
-mimick = MimickDataset(divisible=16, bs=config.bs, dataset='duke_ultrasound', data_dir='gs://tfds-data/datasets')
+mimick = MimickDataset.from_config(config)
 
 # Information taken from https://www.tensorflow.org/datasets/catalog/duke_ultrasound
 train_count = 2556 * config.bs/2
 test_count = 438 * config.bs/2
 val_count = 278 * config.bs/2
+test_frames = 438
 
 train_dataset = mimick.make_dataset(dataset_type='train')
 validation_dataset = mimick.make_dataset(dataset_type='validation')
@@ -19,10 +23,11 @@ test_dataset = mimick.make_dataset(dataset_type='test')
 # Load Model
 # Reset tf session
 tf.keras.backend.clear_session()
+set_precision(config.precision)
 
 model = MimickNet_Conv(shape=(None,None,1),Activation=tf.keras.layers.ReLU(),filters=[16,16,16,16,16], filter_shape=(3,3)).load_model()
 
-model.compile(optimizer=tf.keras.optimizers.Adam(0.002), loss='mae', 
+model.compile(optimizer=make_optimizer(0.002, config.precision), loss='mae', 
               metrics=[losses.mae, losses.mse, losses.ssim, losses.psnr])
 
 # Fit model
@@ -31,7 +36,11 @@ model.fit(train_dataset,
           epochs=int(config.epochs/5),
           validation_data=validation_dataset,
           validation_steps=int(val_count/config.bs),
+          callbacks=[StepStats()],
           verbose=1)
 
+# Test metrics, frames run in shape bucket batches with --bucket_step
+print('Test metrics:', evaluate_dataset(model, test_dataset, test_frames))
+
 # Save model
 model.save("./trained_models/model_noSC_Conv_v1.h5")
\ No newline at end of file
@@ -1,12 +1,18 @@
 import tensorflow as tf
 from config import *
+from utils.export import build_bmode_model
 
-model_pwd = "trained_models/model_noSC_Conv_v1"
+model_pwd = config.model_pwd
 
 # Load model
 # Reset tf session
 tf.keras.backend.clear_session()
-model = tf.keras.models.load_model(f"{model_pwd}.h5")
+model = tf.keras.models.load_model(f"{model_pwd}.h5", compile=False)
+
+# Bake DAS normalization, padding and scan conversion into the graph
+if config.export == 'bmode':
+  model = build_bmode_model(model, clip=config.clipping)
+  model_pwd = f"{model_pwd}_bmode"
 
 # Convert the model.
 converter = tf.lite.TFLiteConverter.from_keras_model(model)
@@ -14,4 +20,4 @@ tflite_model = converter.convert()
 
 # Save the model.
 with open(f"{model_pwd}.tflite", 'wb') as f:
-  f.write(tflite_model)
\ No newline at end of file
+  f.write(tflite_model)
@@ -1,32 +1,134 @@
+import os
+import json
+import hashlib
 import tensorflow as tf
 import tensorflow_datasets as tfds
 
+
 """ MimickDataset"""
 class MimickDataset():
-    def __init__(self, divisible, bs, dataset, data_dir):
+    def __init__(self, divisible, bs, dataset, data_dir, patch_shape=(512, 512), crop_mode='fixed', patches_per_image=1,
+                 clip=-80.0, cache_dir=None, bucket_step=None):
         self.divisible = divisible
         self.bs = bs
         self.dataset = dataset
         self.data_dir = data_dir
+        self.patch_shape = patch_shape
+        self.crop_mode = crop_mode
+        self.patches_per_image = patches_per_image
+        self.clip = clip
+        self.cache_dir = cache_dir
+        self.bucket_step = bucket_step
+        if bucket_step and bucket_step % 16:
+            raise ValueError('bucket_step must be a multiple of 16, got {}'.format(bucket_step))
+
+    @classmethod
+    def from_config(cls, config, bs=None):
+        """duke_ultrasound dataset with the patch, clipping, cache and bucketing flags of config.py"""
+        return cls(divisible=16, bs=bs or config.bs, dataset='duke_ultrasound', data_dir='gs://tfds-data/datasets',
+                   patch_shape=(config.in_h, config.in_w), crop_mode=config.crop_mode,
+                   patches_per_image=config.patches_per_image, clip=config.clipping,
+                   cache_dir=config.cache_dir, bucket_step=config.bucket_step)
 
     def make_dataset(self, dataset_type):
-        ds = tfds.load(self.dataset, data_dir=self.data_dir)
-        dataset = ds[dataset_type]
-        dataset = dataset.map(process)
+        dataset = self.load_cache(dataset_type)
+        if dataset is None:
+            dataset = self.preprocess(dataset_type).cache()
+
         if (dataset_type == 'train' or dataset_type == 'validation'):
-            dataset = dataset.map(make_shape_to_dimension, num_parallel_calls=tf.data.experimental.AUTOTUNE).cache()
+            if self.split_crop_mode(dataset_type) == 'random':
+                # Crop after the cache so every epoch draws new patches
+                dataset = dataset.map(self.make_patches, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            dataset = dataset.unbatch()
             dataset = dataset.batch(self.bs).repeat().prefetch(1)
+        elif self.bucket_step:
+            # Same bucket frames are batched together, 'crop' holds each frame's original shape
+            dataset = dataset.apply(tf.data.experimental.group_by_window(
+                key_func=lambda ele: bucket_key(ele, self.bucket_step),
+                reduce_func=lambda key, frames: frames.batch(self.bs),
+                window_size=self.bs))
+            dataset = dataset.repeat().prefetch(1)
         else:
-            dataset = dataset.map(make_divisible, num_parallel_calls=tf.data.experimental.AUTOTUNE).cache()
             dataset = dataset.batch(1).repeat().prefetch(1)
         return dataset
-    
+
+    def split_crop_mode(self, dataset_type):
+        # Only training draws random crops, validation scores stay comparable across epochs and runs
+        return self.crop_mode if dataset_type == 'train' else 'fixed'
+
+    def make_patches(self, ele, mode=None):
+        return make_patches(ele, self.patch_shape, mode or self.crop_mode, self.patches_per_image)
+
+    def preprocess(self, dataset_type):
+        """Normalized and shaped examples, everything up to the cache point"""
+        ds = tfds.load(self.dataset, data_dir=self.data_dir)
+        dataset = ds[dataset_type]
+        dataset = dataset.map(lambda ele: process(ele, self.clip))
+        if (dataset_type == 'train' or dataset_type == 'validation'):
+            mode = self.split_crop_mode(dataset_type)
+            if mode != 'random':
+                dataset = dataset.map(lambda ele: self.make_patches(ele, mode), num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        elif self.bucket_step:
+            dataset = dataset.map(lambda ele: bucket_pad(ele, self.bucket_step), num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        else:
+            dataset = dataset.map(make_divisible, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        return dataset
+
+    def cache_key(self, dataset_type):
+        """Preprocessing settings that determine the cached examples"""
+        return {
+            'version': 1,
+            'dataset': self.dataset,
+            'split': dataset_type,
+            'clip': float(self.clip),
+            'patch_shape': [int(v) for v in self.patch_shape],
+            'crop_mode': self.split_crop_mode(dataset_type),
+            'patches_per_image': int(self.patches_per_image),
+            'bucket_step': self.bucket_step,
+        }
+
+    def cache_path(self, dataset_type):
+        key = json.dumps(self.cache_key(dataset_type), sort_keys=True)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, '{}-{}-{}'.format(self.dataset, dataset_type, digest))
+
+    def build_cache(self, dataset_type, num_shards=16):
+        """Writes the preprocessed split as GZIP compressed shards, once per preprocessing config"""
+        path = self.cache_path(dataset_type)
+        if tf.io.gfile.exists(path + '.json'):
+            print('Cache exists:', path)
+            return path
+        dataset = self.preprocess(dataset_type).enumerate()
+        tf.data.experimental.save(dataset, path, compression='GZIP',
+                                  shard_func=lambda index, ele: index % num_shards)
+        # The .json marker is written after every shard, so load_cache never opens an interrupted build
+        with tf.io.gfile.GFile(path + '.json', 'w') as f:
+            f.write(json.dumps(self.cache_key(dataset_type), sort_keys=True))
+        print('Cache written:', path)
+        return path
+
+    def load_cache(self, dataset_type):
+        """Preprocessed split streamed from disk, or None when no complete cache exists"""
+        if self.cache_dir is None:
+            return None
+        path = self.cache_path(dataset_type)
+        if not tf.io.gfile.exists(path + '.json'):
+            print('No preprocessed cache at {}, loading {} from tfds'.format(path, dataset_type))
+            return None
+
+        def reader_func(shards):
+            return shards.interleave(lambda shard: shard, cycle_length=tf.data.experimental.AUTOTUNE,
+                                     num_parallel_calls=tf.data.experimental.AUTOTUNE, deterministic=False)
+
+        dataset = tf.data.experimental.load(path, compression='GZIP', reader_func=reader_func)
+        return dataset.map(lambda index, ele: ele)
 
 
-''' Cuts to -80 dB and normalizes images from 0 to 1 '''
-def process(ele):
+
+''' Cuts to -80 dB (or clip) and normalizes images from 0 to 1 '''
+def process(ele, clip=-80.0):
     ele['das'] = tf.reshape(ele['das']['dB'], [ele['height'], ele['width']])
-    ele['das'] = tf.clip_by_value(ele['das'], -80, 0)
+    ele['das'] = tf.clip_by_value(ele['das'], clip, 0)
     ele['das'] = (ele['das'] - tf.reduce_min(ele['das']))/(tf.reduce_max(ele['das']) - tf.reduce_min(ele['das']))
 
     ele['dtce'] = tf.reshape(ele['dtce'], [ele['height'], ele['width']])
@@ -35,37 +137,49 @@ def process(ele):
 
 
 
+''' Maps coordinates onto [0, size) the way repeated tf.pad(..., "REFLECT") calls would '''
+def reflect_indices(coords, size):
+    period = tf.maximum(2*(size - 1), 1)
+    coords = tf.math.floormod(coords, period)
+    return tf.where(coords < size, coords, period - coords)
+
+
+
+''' Reflect pad and crop DAS and DTCE into patch_shape patches with a single gather per image pair.
+    fixed: bottom aligned, horizontally centered crop, identical to the former while_loop padding.
+    random: uniformly placed crops, num_patches of them per image. '''
+def make_patches(ele, patch_shape=(512, 512), mode='fixed', num_patches=1):
+    patch_h, patch_w = patch_shape
+    height = tf.shape(ele['das'])[0]
+    width = tf.shape(ele['das'])[1]
+    pair = tf.stack([ele['das'], ele['dtce']], axis=-1)
+
+    if mode == 'random':
+        row_lo, row_hi = tf.minimum(0, height - patch_h), tf.maximum(0, height - patch_h)
+        col_lo, col_hi = tf.minimum(0, width - patch_w), tf.maximum(0, width - patch_w)
+        row_start = tf.random.uniform([num_patches], row_lo, row_hi + 1, dtype=tf.int32)
+        col_start = tf.random.uniform([num_patches], col_lo, col_hi + 1, dtype=tf.int32)
+    else:
+        # Rows are anchored at the bottom edge. Columns are centered on the
+        # symmetric padding the while_loop grew by width-1 per iteration.
+        steps = tf.maximum(0, -((width - patch_w) // tf.maximum(width - 1, 1)))
+        padded_width = width + 2*steps*(width - 1)
+        row_start = tf.fill([num_patches], height - patch_h)
+        col_start = tf.fill([num_patches], padded_width//2 - patch_w//2 - steps*(width - 1))
+
+    rows = reflect_indices(row_start[:, None] + tf.range(patch_h)[None, :], height)
+    cols = reflect_indices(col_start[:, None] + tf.range(patch_w)[None, :], width)
+    rows = tf.broadcast_to(rows[:, :, None], [num_patches, patch_h, patch_w])
+    cols = tf.broadcast_to(cols[:, None, :], [num_patches, patch_h, patch_w])
+    patches = tf.gather_nd(pair, tf.stack([rows, cols], axis=-1))
+    return patches[..., 0:1], patches[..., 1:2]
+
+
+
 ''' Pad or crop input image until it becomes input shape of max_dimension '''
 def make_shape_to_dimension(ele):
-    # Initialize variables
-    max_dim = 512 
-    height = tf.cast(tf.shape(ele['das'])[0], tf.int32)
-    width = tf.cast(tf.shape(ele['das'])[1], tf.int32)
-    das = ele['das']
-    dtce = ele['dtce']
-
-    # Continuously crop or reflect image until we obtain an image with dimensions max_dimension
-    i = height
-    while tf.less(i, max_dim):
-        das = tf.pad(das, [[height-1,0],[0,0]],"REFLECT")
-        dtce = tf.pad(dtce, [[height-1,0],[0,0]],"REFLECT")
-        i = tf.add(i, height-1)
-
-    i = width
-    while tf.less(i, max_dim):
-        das = tf.pad(das, [[0,0],[width-1,width-1]],"REFLECT")
-        dtce = tf.pad(dtce, [[0,0],[width-1,width-1]],"REFLECT")
-        i = tf.add(i, width-1)
-  
-    # Crop excess of image until we get an image with dimensions max_dimension
-    das = tf.expand_dims(das, axis=2)
-    dtce = tf.expand_dims(dtce, axis=2)
-    centerX = tf.cast(tf.shape(das)[1] / 2, tf.int32)
-    temp_height = tf.cast(tf.shape(das)[0], tf.int32)
-
-    das = tf.image.crop_to_bounding_box(das, temp_height - max_dim, centerX - tf.cast(max_dim/2, tf.int32), max_dim, max_dim)
-    dtce = tf.image.crop_to_bounding_box(dtce, temp_height - max_dim, centerX - tf.cast(max_dim/2, tf.int32), max_dim, max_dim)
-    return das, dtce
+    das, dtce = make_patches(ele, (512, 512))
+    return das[0], dtce[0]
 
 
 
@@ -79,4 +193,26 @@ def make_divisible(ele):
     ele['dtce'] = tf.expand_dims(ele['dtce'], axis = 2)
     ele['das'] = tf.image.resize_with_crop_or_pad(ele['das'], height-height_sub, width-width_sub)
     ele['dtce'] = tf.image.resize_with_crop_or_pad(ele['dtce'], height-height_sub, width-width_sub)
-    return ele
\ No newline at end of file
+    return ele
+
+
+
+''' Reflect pads DAS and DTCE on the bottom and right up to the next multiple of bucket_step
+    (itself a multiple of 16), keeping the original shape in ele['crop'] for unpad '''
+def bucket_pad(ele, bucket_step=128):
+    height = tf.shape(ele['das'])[0]
+    width = tf.shape(ele['das'])[1]
+    rows = reflect_indices(tf.range(-(-height//bucket_step)*bucket_step), height)
+    cols = reflect_indices(tf.range(-(-width//bucket_step)*bucket_step), width)
+    for key in ['das', 'dtce']:
+        ele[key] = tf.gather(tf.gather(ele[key], rows, axis=0), cols, axis=1)[..., None]
+    ele['crop'] = tf.stack([height, width])
+    return ele
+
+def bucket_key(ele, bucket_step=128):
+    shape = tf.cast(tf.shape(ele['das'])[:2] // bucket_step, tf.int64)
+    return shape[0] * 1024 + shape[1]
+
+''' Crops a bucketed batch of model outputs back to the original frame shapes '''
+def unpad(outputs, crops):
+    return [output[:crop[0], :crop[1]] for output, crop in zip(outputs, crops)]
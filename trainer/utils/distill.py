@@ -0,0 +1,119 @@
+import json
+import tensorflow as tf
+from tensorflow.keras.layers import Conv2D, MaxPool2D
+
+''' Feature layers of a MimickNet U-Net: the encoder skip features, one per resolution,
+    then the last decoder feature feeding the 1x1 output convolution '''
+def feature_layers(model):
+    skips = [layer.inbound_nodes[0].inbound_layers for layer in model.layers if isinstance(layer, MaxPool2D)]
+    head = [layer for layer in model.layers if type(layer) is Conv2D and layer.kernel_size == (1, 1)][-1]
+    return skips, head.inbound_nodes[0].inbound_layers
+
+''' Model returning the output followed by num_skips skip features, shallowest first, and the head feature '''
+def feature_model(model, num_skips):
+    skips, head = feature_layers(model)
+    return tf.keras.Model(model.inputs, [model.output] + [layer.output for layer in skips[:num_skips] + [head]])
+
+''' Channel-agnostic spatial attention of a [B, H, W, C] feature map, so a student with
+    fewer filters can match the teacher without adapter layers '''
+def attention_map(feature):
+    attention = tf.reduce_mean(tf.square(tf.cast(feature, tf.float32)), axis=-1)
+    attention = tf.reshape(attention, [tf.shape(attention)[0], -1])
+    return tf.math.l2_normalize(attention, axis=-1)
+
+def shared_skips(student, teacher):
+    return min(len(feature_layers(student)[0]), len(feature_layers(teacher)[0]))
+
+''' Teacher soft targets and attention maps for a (das, dtce) batch '''
+def teacher_targets(teacher_features, das):
+    soft, *features = teacher_features(das, training=False)
+    return tf.cast(soft, tf.float32), tuple(attention_map(feature) for feature in features)
+
+
+class Distiller(tf.keras.Model):
+    """Trains a small MimickNet student against dtce, the teacher output and the teacher attention maps.
+
+    Batches are either (das, dtce), with the teacher run on the fly, or (das, dtce, soft, maps)
+    read from a store written by build_teacher_cache."""
+    def __init__(self, student, teacher=None, num_skips=None, alpha=0.5, feature_weight=1.0):
+        super().__init__()
+        self.student = student
+        self.num_skips = num_skips if num_skips is not None else shared_skips(student, teacher)
+        self.student_features = feature_model(student, self.num_skips)
+        self.teacher_features = feature_model(teacher, self.num_skips) if teacher is not None else None
+        self.alpha = alpha
+        self.feature_weight = feature_weight
+        self.trackers = {key: tf.keras.metrics.Mean(key) for key in ['loss', 'mae', 'soft_mae', 'feature', 'ssim']}
+
+    @property
+    def metrics(self):
+        return list(self.trackers.values())
+
+    def call(self, inputs, training=False):
+        return self.student(inputs, training=training)
+
+    def unpack(self, data):
+        if len(data) == 2:
+            das, dtce = data
+            soft, maps = teacher_targets(self.teacher_features, das)
+            return das, dtce, soft, maps
+        return data
+
+    def distillation_loss(self, dtce, soft, maps, outputs):
+        output, *features = outputs
+        output = tf.cast(output, tf.float32)
+        mae = tf.reduce_mean(tf.abs(dtce - output))
+        soft_mae = tf.reduce_mean(tf.abs(soft - output))
+        feature = tf.add_n([tf.reduce_mean(tf.reduce_sum(tf.square(attention_map(f) - m), -1))
+                            for f, m in zip(features, maps)])
+        loss = self.alpha * mae + (1 - self.alpha) * soft_mae + self.feature_weight * feature
+        return output, {'loss': loss, 'mae': mae, 'soft_mae': soft_mae, 'feature': feature}
+
+    def update_trackers(self, dtce, output, losses):
+        losses['ssim'] = tf.reduce_mean(tf.image.ssim(dtce, output, 1))
+        for key, value in losses.items():
+            self.trackers[key].update_state(value)
+        return {key: tracker.result() for key, tracker in self.trackers.items()}
+
+    def train_step(self, data):
+        das, dtce, soft, maps = self.unpack(data)
+        with tf.GradientTape() as tape:
+            output, losses = self.distillation_loss(dtce, soft, maps, self.student_features(das, training=True))
+        # minimize applies loss scaling when the optimizer is a LossScaleOptimizer
+        self.optimizer.minimize(losses['loss'], self.student.trainable_variables, tape=tape)
+        return self.update_trackers(dtce, output, losses)
+
+    def test_step(self, data):
+        das, dtce, soft, maps = self.unpack(data)
+        output, losses = self.distillation_loss(dtce, soft, maps, self.student_features(das, training=False))
+        return self.update_trackers(dtce, output, losses)
+
+
+def build_teacher_cache(teacher, dataset, path, steps, num_skips):
+    """Writes steps (das, dtce, soft, maps) batches of a (das, dtce) dataset, so the teacher runs once.
+    Use fixed crops, random patches would only ever replay the cached ones."""
+    if tf.io.gfile.exists(path + '.json'):
+        print('Teacher cache exists:', path)
+        return path
+    teacher_features = feature_model(teacher, num_skips)
+
+    def generator():
+        for das, dtce in dataset.take(steps):
+            soft, maps = teacher_targets(teacher_features, das)
+            yield das, dtce, soft, maps
+
+    das_spec, dtce_spec = dataset.element_spec
+    map_spec = tuple(tf.TensorSpec([None, None], tf.float32) for _ in range(num_skips + 1))
+    cache = tf.data.Dataset.from_generator(generator, output_signature=(
+        das_spec, dtce_spec, tf.TensorSpec(dtce_spec.shape, tf.float32), map_spec))
+    tf.data.experimental.save(cache, path, compression='GZIP')
+    # load_teacher_cache only opens a store that has this file
+    with tf.io.gfile.GFile(path + '.json', 'w') as f:
+        f.write(json.dumps({'steps': steps, 'num_skips': num_skips}))
+    print('Teacher cache written:', path)
+    return path
+
+def load_teacher_cache(path):
+    if not tf.io.gfile.exists(path + '.json'):
+        raise ValueError('No complete teacher cache at {}'.format(path))
+    return tf.data.experimental.load(path, compression='GZIP').repeat().prefetch(1)
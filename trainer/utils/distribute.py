@@ -0,0 +1,75 @@
+""" tf.distribute helpers for data-parallel training, plus a local multi-worker launcher.
+
+Try multi-worker training on one host, from the trainer directory, e.g.
+    python -m utils.distribute --workers 2 -- python train_model_conv.py --strategy multi_worker --epochs 5
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+import subprocess
+import tensorflow as tf
+
+STRATEGIES = ['default', 'mirrored', 'multi_worker']
+
+
+def make_strategy(name='default'):
+    if name == 'mirrored':
+        return tf.distribute.MirroredStrategy()
+    if name == 'multi_worker':
+        # The cluster comes from TF_CONFIG, without it this is a single worker
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    if name == 'default':
+        return tf.distribute.get_strategy()
+    raise ValueError('strategy must be one of {}'.format(STRATEGIES))
+
+
+def shard_dataset(dataset):
+    """Shards by element across workers. The TFDS and cache files are too few to give every worker its own."""
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    return dataset.with_options(options)
+
+
+def is_chief():
+    task = json.loads(os.environ.get('TF_CONFIG', '{}')).get('task', {})
+    return task.get('type', 'chief') == 'chief' or (task.get('type') == 'worker' and task.get('index') == 0)
+
+
+def worker_path(path):
+    """Every worker must take part in saving, only the chief writes to the real path, the rest to a temp directory"""
+    if is_chief():
+        return path
+    task = json.loads(os.environ['TF_CONFIG'])['task']
+    directory = os.path.join(tempfile.gettempdir(), '{}{}'.format(task['type'], task['index']))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, os.path.basename(path))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def launch_local(command, workers=2):
+    """Runs command once per worker with a localhost TF_CONFIG cluster and waits for all of them"""
+    cluster = {'worker': ['localhost:{}'.format(free_port()) for _ in range(workers)]}
+    processes = []
+    for index in range(workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': index}}))
+        processes.append(subprocess.Popen(command, env=env))
+    return max(process.wait() for process in processes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2, help='local worker processes')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='training command, after --')
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    sys.exit(launch_local(command, args.workers))
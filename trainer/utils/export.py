@@ -0,0 +1,41 @@
+import tensorflow as tf
+
+''' Clips DAS dB to the clipping level and normalizes from 0 to 1, graph version of MimickNet_Dataset.process '''
+def normalize_das(inputs, clip=-80.0):
+    das = tf.clip_by_value(inputs, clip, 0)
+    das_min = tf.reduce_min(das, axis=[1, 2, 3], keepdims=True)
+    das_max = tf.reduce_max(das, axis=[1, 2, 3], keepdims=True)
+    return (das - das_min)/(das_max - das_min)
+
+''' Reflect pads height and width up to the next multiple of 16 '''
+def custom_pad(inputs):
+    shape = tf.shape(inputs)
+    height_pad = (16 - shape[1] % 16)
+    width_pad = (16 - shape[2] % 16)
+    padded = tf.pad(inputs, [[0,0],
+                           [0,height_pad],
+                           [0,width_pad],
+                           [0,0]], mode='REFLECT')
+    # Restores the static channel count, which TFLite conv kernels need
+    return tf.reshape(padded, [shape[0], shape[1] + height_pad, shape[2] + width_pad, inputs.shape[-1]])
+
+''' Crops model output back to the original input shape and clips to [0, 1] '''
+def custom_depad(inputs):
+    original = inputs[0]
+    final = inputs[1]
+    shape = tf.shape(original)
+    final = final[:, :shape[1], :shape[2], :]
+    final = tf.clip_by_value(final, 0, 1)
+    return final
+
+''' Wraps a trained model into DAS dB + geometry in, scan converted B-mode out '''
+def build_bmode_model(model, clip=-80.0):
+    from utils.scan_convert import ScanConvert
+    inputs = tf.keras.layers.Input(shape=(None, None, 1))
+    geometry = tf.keras.layers.Input(shape=(4,))
+    das = tf.keras.layers.Lambda(lambda x: normalize_das(x, clip))(inputs)
+    x = tf.keras.layers.Lambda(custom_pad)(das)
+    x = model(x)
+    x = tf.keras.layers.Lambda(custom_depad)([das, x])
+    x = ScanConvert()([x, geometry])
+    return tf.keras.Model([inputs, geometry], x)
@@ -0,0 +1,101 @@
+""" Memory-mapped store of normalized DAS / DTCE frames, so evaluation never re-parses .mat files.
+
+Build once from the CSVs, from the trainer directory, e.g.
+    python -m utils.frame_store --csv gs://duke-research-us/mimicknet/data/testing-v2.csv --out ./frame_store
+"""
+
+import os
+import json
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+import scipy.io as sio
+import tensorflow as tf
+
+_GEOMETRY_KEYS = ['initial_radius', 'final_radius', 'initial_angle', 'final_angle']
+_DATA_FILE = 'frames.f32'
+_INDEX_FILE = 'index.json'
+
+
+def load_mat_frame(args):
+    """Reads one .mat file and returns the normalized DAS and clinical images and any probe geometry"""
+    filename, bucket, clip, iq_key, dtce_key = args
+    matfile = sio.loadmat(tf.io.gfile.GFile('{}/{}'.format(bucket, filename), 'rb'))
+    iq = np.abs(matfile[iq_key])
+    iq = 20*np.log10(iq/iq.max())
+    iq = np.clip(iq, clip, 0)
+    iq = (iq - iq.min())/(iq.max()-iq.min())
+    dtce = matfile[dtce_key]
+    dtce = (dtce - dtce.min())/(dtce.max()-dtce.min())
+    geometry = {key: float(np.squeeze(matfile[key])) for key in _GEOMETRY_KEYS if key in matfile}
+    return filename, iq.astype(np.float32), dtce.astype(np.float32), geometry
+
+
+class FrameStore():
+    """Read-only view of a store written by build_frame_store. Frames are zero-copy memmap slices."""
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, _INDEX_FILE)) as f:
+            index = json.load(f)
+        self.clip = index['clip']
+        self.entries = index['entries']
+        self.data = np.memmap(os.path.join(store_dir, _DATA_FILE), dtype=np.float32, mode='r')
+
+    def __contains__(self, filename):
+        return filename in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def view(self, filename, key):
+        offset, height, width = self.entries[filename][key]
+        return self.data[offset:offset + height*width].reshape(height, width)
+
+    def get(self, filename):
+        """Returns (das, dtce, geometry) for a filename, das and dtce as read-only views"""
+        return self.view(filename, 'das'), self.view(filename, 'dtce'), self.entries[filename]['geometry']
+
+
+def build_frame_store(csv_paths, store_dir, bucket='gs://duke-research-us/mimicknet/data/duke-ultrasound-v1',
+                      clip=-80, workers=None, iq_key='iq', dtce_key='dtce'):
+    filenames, seen = [], set()
+    for csv_path in csv_paths:
+        df = pd.read_csv(tf.io.gfile.GFile(csv_path, 'rb'))
+        for filename in df.filename:
+            if filename not in seen:
+                seen.add(filename)
+                filenames.append(filename)
+    tasks = [(filename, bucket, clip, iq_key, dtce_key) for filename in filenames]
+
+    os.makedirs(store_dir, exist_ok=True)
+    entries = {}
+    offset = 0
+    # Workers are spawned rather than forked: load_mat_frame reads through tf.io.gfile, and a forked
+    # child inherits TensorFlow's threads and locks in whatever state the parent left them
+    with open(os.path.join(store_dir, _DATA_FILE), 'wb') as f, \
+         multiprocessing.get_context('spawn').Pool(workers or multiprocessing.cpu_count()) as pool:
+        for i, (filename, das, dtce, geometry) in enumerate(pool.imap(load_mat_frame, tasks)):
+            entry = {'geometry': geometry}
+            for key, frame in [('das', das), ('dtce', dtce)]:
+                frame.tofile(f)
+                entry[key] = [offset, frame.shape[0], frame.shape[1]]
+                offset += frame.size
+            entries[filename] = entry
+            print('{}/{} - {}'.format(i + 1, len(tasks), filename))
+
+    # The index is written last, a partial build has no index
+    with open(os.path.join(store_dir, _INDEX_FILE), 'w') as f:
+        json.dump({'clip': clip, 'entries': entries}, f)
+    return FrameStore(store_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', nargs='+', default=['gs://duke-research-us/mimicknet/data/testing-v2.csv'])
+    parser.add_argument('--bucket', default='gs://duke-research-us/mimicknet/data/duke-ultrasound-v1')
+    parser.add_argument('--out', default='./frame_store', help='Frame store directory')
+    parser.add_argument('--clip', type=int, default=-80)
+    parser.add_argument('--workers', type=int, default=None, help='.mat parsing processes')
+    args = parser.parse_args()
+
+    build_frame_store(args.csv, args.out, bucket=args.bucket, clip=args.clip, workers=args.workers)
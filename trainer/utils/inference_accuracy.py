@@ -1,2 +1,163 @@
+""" Batched, parallel test set evaluation, a headless replacement for GetCsvMetrics.full_validation.
+
+Run from the trainer directory, e.g.
+    python -m utils.inference_accuracy --forward ../example_models/model_noSC_Conv_v1.h5 --out metrics.csv
+"""
+
+import csv
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
 import tensorflow as tf
+from skimage.exposure import match_histograms
+from utils.metrics import fused_metrics
+from utils.frame_store import FrameStore, load_mat_frame
+from utils.export import custom_pad, custom_depad
+
+_METRICS = ['mse', 'mae', 'ssim', 'contrast_structure', 'luminance', 'psnr', 'corr']
+_FIELDNAMES = ['filename'] + ['{}{}'.format(prefix, key) for prefix in ['', 'iq_', 'hm_', 'hm_iq_'] for key in _METRICS]
+
+
+def match_pair(dtce, output, das):
+    return match_histograms(dtce, das), match_histograms(output, das)
+
+
+def get_batch_metrics(x, y):
+    """Per-image metrics of two [B, H, W, 1] batches, computed in one pass on device"""
+    return {key: value.numpy() for key, value in fused_metrics(x, y, 1).items()}
+
+
+def evaluate_batch(forward, frames, pool=None):
+    """Metric rows of (filename, das, dtce, ...) frames of one shape, histogram matched on pool when given.
+    hm_iq_ compares the matched dtce with das, as iq_ compares dtce with das."""
+    filenames = [frame[0] for frame in frames]
+    das = np.stack([frame[1] for frame in frames])[..., None]
+    dtce = np.stack([frame[2] for frame in frames])[..., None]
+    output = np.asarray(forward.predict_on_batch(das))
+
+    results = {
+        '': get_batch_metrics(dtce, output),
+        'iq_': get_batch_metrics(dtce, das),
+    }
+    pairs = zip(dtce[..., 0], output[..., 0], das[..., 0])
+    matched = pool.starmap(match_pair, pairs) if pool is not None else list(itertools.starmap(match_pair, pairs))
+    hm_dtce = np.stack([pair[0] for pair in matched])[..., None]
+    hm_output = np.stack([pair[1] for pair in matched])[..., None]
+    results['hm_'] = get_batch_metrics(hm_dtce, hm_output)
+    results['hm_iq_'] = get_batch_metrics(hm_dtce, das)
+
+    rows = []
+    for i, filename in enumerate(filenames):
+        row = {'filename': filename}
+        for prefix, metrics in results.items():
+            for key, value in metrics.items():
+                row['{}{}'.format(prefix, key)] = value[i]
+        rows.append(row)
+    return rows
+
+
+def evaluate_dataset(model, dataset, num_frames):
+    """Mean metrics of model over num_frames frames of a MimickDataset test split. Bucketed batches
+    run through the model together, each output is cropped back to its frame with unpad before scoring."""
+    from utils.MimickNet_Dataset import unpad
+    totals, count = {}, 0
+    for ele in dataset:
+        outputs = np.asarray(model.predict_on_batch(ele['das']), dtype=np.float32)
+        dtce = ele['dtce'].numpy()
+        if 'crop' in ele:
+            crops = ele['crop'].numpy()
+            outputs, dtce = unpad(outputs, crops), unpad(dtce, crops)
+        for x, y in zip(dtce, outputs):
+            for key, value in get_batch_metrics(x[None], y[None]).items():
+                totals[key] = totals.get(key, 0.0) + float(value[0])
+        count += len(outputs)
+        # The split repeats, one pass is exactly num_frames frames
+        if count >= num_frames:
+            break
+    return {key: value / count for key, value in totals.items()}
+
+
+class AccuracyEvaluator():
+    def __init__(self, forward, dataset_csvpath, out_filepath,
+                 bucket='gs://duke-research-us/mimicknet/data/duke-ultrasound-v1', clip=-80,
+                 batch_size=8, workers=None, frame_store=None):
+        self.df = pd.read_csv(tf.io.gfile.GFile(dataset_csvpath, 'rb'))
+        self.forward = forward
+        self.out_filepath = out_filepath
+        self.bucket = bucket
+        self.clip = clip
+        self.batch_size = batch_size
+        self.workers = workers or multiprocessing.cpu_count()
+        self.frame_store = FrameStore(frame_store) if isinstance(frame_store, str) else frame_store
+        if self.frame_store is not None and self.frame_store.clip != clip:
+            raise ValueError('Frame store was built with clip {}, not {}'.format(self.frame_store.clip, clip))
+
+    def frames(self, pool, tasks):
+        if self.frame_store is None:
+            return pool.imap_unordered(load_mat_frame, tasks)
+        # Filenames missing from the store are parsed from their .mat files, in the background while stored frames are read
+        missing = [task for task in tasks if task[0] not in self.frame_store]
+        if missing:
+            print('{} of {} frames are not in the frame store, loading them from .mat files'.format(len(missing), len(tasks)))
+        loaded = pool.imap_unordered(load_mat_frame, missing)
+        stored = ((task[0],) + self.frame_store.get(task[0]) for task in tasks if task[0] in self.frame_store)
+        return itertools.chain(stored, loaded)
+
+    def run(self):
+        tasks = [(filename, self.bucket, self.clip, 'iq', 'dtce') for filename in self.df.filename]
+        buckets = {}
+        done = 0
+        context = multiprocessing.get_context('spawn')
+        with tf.io.gfile.GFile(self.out_filepath, 'w') as f, \
+             context.Pool(self.workers) as load_pool, context.Pool(self.workers) as match_pool:
+            writer = csv.DictWriter(f, fieldnames=_FIELDNAMES)
+            writer.writeheader()
+
+            def flush(shape):
+                nonlocal done
+                rows = evaluate_batch(self.forward, buckets.pop(shape), match_pool)
+                writer.writerows(rows)
+                f.flush()
+                done += len(rows)
+                print('{}/{} - {}'.format(done, len(tasks), rows[-1]['filename']))
+
+            # Both pools are spawned like build_frame_store's. Histogram matching has its own pool,
+            # queued behind the loads it would wait for every .mat file before the first batch completes.
+            # Same shape frames share a batch, results are written as soon as a batch completes
+            for frame in self.frames(load_pool, tasks):
+                shape = frame[1].shape
+                buckets.setdefault(shape, []).append(frame)
+                if len(buckets[shape]) == self.batch_size:
+                    flush(shape)
+            for shape in list(buckets):
+                flush(shape)
+
+
+def load_forward(filepath):
+    """Wraps a trained model with the reflect pad / depad used by get_csv_metrics"""
+    model = tf.keras.models.load_model(filepath, compile=False)
+    inputs = tf.keras.layers.Input(shape=(None, None, 1))
+    x = tf.keras.layers.Lambda(custom_pad)(inputs)
+    x = model(x)
+    x = tf.keras.layers.Lambda(custom_depad)([inputs, x])
+    return tf.keras.Model(inputs, x)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--forward', required=True, help='Forward .h5 model filepath')
+    parser.add_argument('--csv', default='gs://duke-research-us/mimicknet/data/testing-v2.csv')
+    parser.add_argument('--bucket', default='gs://duke-research-us/mimicknet/data/duke-ultrasound-v1')
+    parser.add_argument('--out', default='metrics.csv', help='Metrics output filepath')
+    parser.add_argument('--clip', type=int, default=-80)
+    parser.add_argument('--bs', type=int, default=8, help='frames per model batch')
+    parser.add_argument('--workers', type=int, default=None, help='loader and histogram matching processes')
+    parser.add_argument('--frame_store', default=None, help='Memory-mapped frame store built by utils/frame_store.py')
+    args = parser.parse_args()
 
+    evaluator = AccuracyEvaluator(load_forward(args.forward), args.csv, args.out,
+                                  bucket=args.bucket, clip=args.clip,
+                                  batch_size=args.bs, workers=args.workers, frame_store=args.frame_store)
+    evaluator.run()
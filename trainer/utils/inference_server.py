@@ -0,0 +1,222 @@
+""" Local MimickNet inference server with asyncio micro-batching, meant to run next to the beamformer.
+
+Run from the trainer directory, e.g.
+    python -m utils.inference_server --model ../example_models/model_noSC_Conv_v1.h5 --unix /tmp/mimicknet.sock
+
+Protocol, HTTP/1.1 with keep-alive so a client can stream a cine loop over one connection:
+    POST /infer   body: float32 DAS dB frame, row major
+                  headers: X-Height, X-Width, optional X-Geometry: irad,frad,iang,fang to scan convert
+                  response body: float32 frame, shape in X-Height / X-Width
+    GET /metrics  queue depth, batch sizes and latency percentiles as JSON
+"""
+
+import json
+import time
+import asyncio
+import argparse
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+import tensorflow as tf
+from utils.tflite import load_interpreter, normalize_db_, ZeroCopyRunner
+from utils.scan_convert import scan_convert_np
+
+
+class Metrics():
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.batches = 0
+        self.batched_frames = 0
+        self.latencies = collections.deque(maxlen=window)
+
+    def report(self, queue_depth):
+        latencies = np.asarray(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {
+            'queue_depth': queue_depth,
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_frames / max(self.batches, 1),
+            'latency_p50_ms': float(p50),
+            'latency_p90_ms': float(p90),
+            'latency_p99_ms': float(p99),
+        }
+
+
+class FrameRunner():
+    """Normalizes, pads, runs and scan converts a same-shape batch. Safe to call from several threads."""
+    def __init__(self, model_path, clip=-80.0, num_threads=None, max_runners=4):
+        self.model_path = model_path
+        self.clip = clip
+        self.num_threads = num_threads
+        self.max_runners = max_runners
+        self.local = threading.local()
+        if not model_path.endswith('.tflite'):
+            model = tf.keras.models.load_model(model_path, compile=False)
+            self.keras_predict = tf.function(model, experimental_relax_shapes=True)
+
+    def predict(self, batch):
+        if not self.model_path.endswith('.tflite'):
+            return self.keras_predict(batch).numpy()
+        # Interpreters are not thread safe, every worker thread keeps its own for the
+        # max_runners most recently used batch shapes
+        runners = self.local.__dict__.setdefault('runners', collections.OrderedDict())
+        if batch.shape in runners:
+            runners.move_to_end(batch.shape)
+        else:
+            if len(runners) >= self.max_runners:
+                runners.popitem(last=False)
+            runners[batch.shape] = ZeroCopyRunner(load_interpreter(self.model_path, num_threads=self.num_threads), batch.shape)
+        return runners[batch.shape](batch)
+
+    def __call__(self, frames, geometries):
+        das = normalize_db_(np.stack(frames).astype(np.float32, copy=False), self.clip)
+
+        height, width = das.shape[1:]
+        pad = [[0, 0], [0, -height % 16], [0, -width % 16]]
+        output = self.predict(np.pad(das, pad, mode='reflect')[..., None].astype(np.float32))
+        output = np.clip(output[:, :height, :width, 0], 0, 1)
+        return [output[i] if geometry is None else scan_convert_np(output[i], *geometry)
+                for i, geometry in enumerate(geometries)]
+
+
+class MicroBatcher():
+    """Coalesces queued frames into batches of up to max_batch, waiting at most max_delay for stragglers"""
+    def __init__(self, runner, max_batch=8, max_delay_ms=5, workers=2):
+        self.runner = runner
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.queue = asyncio.Queue()
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.metrics = Metrics()
+        # The event loop only keeps weak references to tasks, in-flight batches are held here until done
+        self.tasks = set()
+
+    async def submit(self, frame, geometry):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((frame, geometry, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Only same-shape frames can share a model batch
+            groups = collections.defaultdict(list)
+            for item in items:
+                groups[item[0].shape].append(item)
+            for group in groups.values():
+                task = loop.create_task(self.run_group(group))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def run_group(self, group):
+        loop = asyncio.get_running_loop()
+        try:
+            outputs = await loop.run_in_executor(self.executor, self.runner,
+                                                 [item[0] for item in group], [item[1] for item in group])
+        except Exception as e:
+            for item in group:
+                item[2].set_exception(e)
+            return
+        self.metrics.batches += 1
+        self.metrics.batched_frames += len(group)
+        now = time.perf_counter()
+        for item, output in zip(group, outputs):
+            self.metrics.latencies.append(now - item[3])
+            item[2].set_result(output)
+
+
+async def write_response(writer, status, body, headers=None):
+    lines = ['HTTP/1.1 {}'.format(status), 'Content-Length: {}'.format(len(body))]
+    lines += ['{}: {}'.format(key, value) for key, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+    await writer.drain()
+
+
+def make_handler(batcher):
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    key, value = line.split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'GET' and path == '/metrics':
+                    report = batcher.metrics.report(batcher.queue.qsize())
+                    await write_response(writer, '200 OK', json.dumps(report).encode(),
+                                         {'Content-Type': 'application/json'})
+                elif method == 'POST' and path == '/infer':
+                    batcher.metrics.requests += 1
+                    shape = (int(headers['x-height']), int(headers['x-width']))
+                    frame = np.frombuffer(body, dtype=np.float32).reshape(shape)
+                    geometry = headers.get('x-geometry')
+                    geometry = tuple(float(v) for v in geometry.split(',')) if geometry else None
+                    try:
+                        output = await batcher.submit(frame, geometry)
+                    except Exception as e:
+                        # e.g. a .tflite exported with a fixed input size, the connection stays usable
+                        await write_response(writer, '500 Internal Server Error', str(e).encode())
+                        continue
+                    await write_response(writer, '200 OK', output.astype(np.float32).tobytes(),
+                                         {'Content-Type': 'application/octet-stream',
+                                          'X-Height': output.shape[0], 'X-Width': output.shape[1]})
+                else:
+                    await write_response(writer, '404 Not Found', b'')
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        except (KeyError, ValueError) as e:
+            await write_response(writer, '400 Bad Request', str(e).encode())
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(runner, host='127.0.0.1', port=8500, unix=None, max_batch=8, max_delay_ms=5, workers=2):
+    batcher = MicroBatcher(runner, max_batch=max_batch, max_delay_ms=max_delay_ms, workers=workers)
+    handler = make_handler(batcher)
+    if unix:
+        server = await asyncio.start_unix_server(handler, path=unix)
+    else:
+        server = await asyncio.start_server(handler, host, port)
+    print('Serving on', unix or '{}:{}'.format(host, port))
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='.h5 or .tflite model filepath')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--unix', default=None, help='Unix socket path, overrides host and port')
+    parser.add_argument('--clip', type=float, default=-80.0, help='DAS dB clipping')
+    parser.add_argument('--max_batch', type=int, default=8, help='largest micro-batch')
+    parser.add_argument('--max_delay_ms', type=float, default=5, help='longest wait for a micro-batch to fill')
+    parser.add_argument('--workers', type=int, default=2, help='model worker threads')
+    parser.add_argument('--num_threads', type=int, default=None, help='threads per TFLite interpreter')
+    parser.add_argument('--max_runners', type=int, default=4, help='TFLite interpreters each worker keeps, one per recent batch shape')
+    args = parser.parse_args()
+
+    runner = FrameRunner(args.model, clip=args.clip, num_threads=args.num_threads, max_runners=args.max_runners)
+    asyncio.run(serve(runner, args.host, args.port, args.unix, args.max_batch, args.max_delay_ms, args.workers))
@@ -1,2 +1,117 @@
-import tensorflow as tf
+""" Inference latency benchmark for .h5 and .tflite MimickNet models.
 
+Run from the trainer directory, e.g.
+    python -m utils.inference_speed --models ../example_models/model.tflite --threads 1 2 4 --out speed.csv
+"""
+
+import os
+import csv
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+
+_FIELDNAMES = ['model', 'height', 'width', 'batch', 'num_threads', 'runs',
+               'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'frames_per_s', 'peak_rss_mb']
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(latencies, batch):
+    latencies = np.asarray(latencies) * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        'runs': len(latencies),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(p50),
+        'p90_ms': float(p90),
+        'p99_ms': float(p99),
+        'frames_per_s': float(1000 * batch / latencies.mean()),
+    }
+
+
+def make_runner(model_path, num_threads):
+    """Returns a callable running one float32 [B, H, W, 1] batch through the model"""
+    import tensorflow as tf
+    if model_path.endswith('.tflite'):
+        from utils.tflite import load_interpreter, run_tflite
+        interpreter = load_interpreter(model_path, num_threads=num_threads)
+        return lambda image: run_tflite(interpreter, image)
+
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    model = tf.keras.models.load_model(model_path, compile=False)
+    predict = tf.function(model, experimental_relax_shapes=True)
+    return lambda image: predict(image).numpy()
+
+
+def benchmark_config(model_path, num_threads, height, width, batch, warmup, runs):
+    """Times one configuration, meant to run in a fresh process so peak_rss_mb is its own"""
+    run = make_runner(model_path, num_threads)
+    image = np.random.uniform(size=(batch, height, width, 1)).astype(np.float32)
+    try:
+        run(image)
+    except (RuntimeError, ValueError) as e:
+        # e.g. a .tflite exported with a fixed input size
+        print('Skipping {} {}x{}x{}: {}'.format(model_path, batch, height, width, e))
+        return None
+    for _ in range(warmup - 1):
+        run(image)
+    latencies = []
+    for _ in range(runs):
+        t_start = time.perf_counter()
+        run(image)
+        latencies.append(time.perf_counter() - t_start)
+    row = {'model': os.path.basename(model_path), 'height': height, 'width': width,
+           'batch': batch, 'num_threads': num_threads}
+    row.update(summarize(latencies, batch))
+    row['peak_rss_mb'] = peak_rss_mb()
+    print(row)
+    return row
+
+
+def benchmark(models, threads, dimensions, batches, warmup=5, runs=50):
+    # Intra-op threads can only be set once per TensorFlow process, and peak RSS is the
+    # process lifetime maximum, so every configuration gets its own interpreter process.
+    ctx = multiprocessing.get_context('spawn')
+    configs = [(model_path, num_threads, height, width, batch)
+               for model_path in models for num_threads in threads
+               for height in dimensions for width in dimensions for batch in batches]
+    rows = []
+    for config in configs:
+        with ctx.Pool(1) as pool:
+            row = pool.apply(benchmark_config, config + (warmup, runs))
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def write_results(rows, out):
+    if out.endswith('.json'):
+        with open(out, 'w') as f:
+            json.dump(rows, f, indent=2)
+    else:
+        with open(out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=_FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', nargs='+', required=True, help='.h5 or .tflite model filepaths')
+    parser.add_argument('--dimensions', nargs='+', type=int, default=[128, 256, 512, 1024], help='height and width sweep, every pair is run')
+    parser.add_argument('--batches', nargs='+', type=int, default=[1, 4, 8], help='batch size sweep')
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, os.cpu_count()], help='num_threads sweep')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed runs per configuration')
+    parser.add_argument('--runs', type=int, default=50, help='timed runs per configuration')
+    parser.add_argument('--out', default='inference_speed.csv', help='.csv or .json results filepath')
+    args = parser.parse_args()
+
+    results = benchmark(args.models, args.threads, args.dimensions, args.batches, args.warmup, args.runs)
+    write_results(results, args.out)
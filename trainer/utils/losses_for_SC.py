@@ -70,8 +70,11 @@ def _ssim_helper(x, y, reducer, max_val, compensation=1.0):
     # SSIM luminance measure is
     # (2 * mu_x * mu_y + c1) / (mu_x ** 2 + mu_y ** 2 + c1).
 
-    mean0 = reducer(x)
-    mean1 = reducer(y)
+    # Every moment, plus the nonzero mask, comes from one filtered pass over the stacked inputs.
+    zero = tf.constant(0, tf.float32)
+    nonzero = tf.cast(tf.not_equal(x, zero), tf.float32)
+    moments = reducer(array_ops.concat([x, y, x * y, math_ops.square(x) + math_ops.square(y), nonzero], axis=-1))
+    mean0, mean1, mean_xy, mean_xx_yy, mask = array_ops.split(moments, 5, axis=-1)
     num0 = mean0 * mean1 * 2.0
     den0 = math_ops.square(mean0) + math_ops.square(mean1)
     luminance = (num0 + c1) / (den0 + c1)
@@ -82,15 +85,13 @@ def _ssim_helper(x, y, reducer, max_val, compensation=1.0):
     # Note that `reducer` is a weighted sum with weight w_k, \sum_i w_i = 1, then
     #   cov_{xy} = \sum_i w_i (x_i - \mu_x) (y_i - \mu_y)
     #          = \sum_i w_i x_i y_i - (\sum_i w_i x_i) (\sum_j w_j y_j).
-    num1 = reducer(x * y) * 2.0
-    den1 = reducer(math_ops.square(x) + math_ops.square(y))
+    num1 = mean_xy * 2.0
+    den1 = mean_xx_yy
     c2 *= compensation
     cs = (num1 - num0 + c2) / (den1 - den0 + c2)  
 
     ''' Masking zero values '''
-    zero = tf.constant(0, tf.float32)
-    mask = tf.cast(tf.not_equal(x, zero), tf.float32)
-    mask = tf.cast(reducer(mask), tf.bool)
+    mask = tf.cast(mask, tf.bool)
     zeros = tf.zeros(shape=tf.shape(mask))
     
     luminance = tf.where(mask, luminance, zeros)
@@ -100,7 +101,8 @@ def _ssim_helper(x, y, reducer, max_val, compensation=1.0):
     return luminance, cs, mask
 
 
-def _fspecial_gauss(size, sigma):
+def _fspecial_gauss_1d(size, sigma):
+    # The 2-D Gaussian is the outer product of this normalized 1-D kernel.
     size = ops.convert_to_tensor(size, dtypes.int32)
     sigma = ops.convert_to_tensor(sigma)
 
@@ -109,11 +111,7 @@ def _fspecial_gauss(size, sigma):
 
     g = math_ops.square(coords)
     g *= -0.5 / math_ops.square(sigma)
-
-    g = array_ops.reshape(g, shape=[1, -1]) + array_ops.reshape(g, shape=[-1, 1])
-    g = array_ops.reshape(g, shape=[1, -1])  # For tf.nn.softmax().
-    g = nn_ops.softmax(g)
-    return array_ops.reshape(g, shape=[size, size, 1, 1])
+    return nn_ops.softmax(g)
 
 
 def _ssim_per_channel(img1, img2, max_val=1.0):
@@ -131,15 +129,19 @@ def _ssim_per_channel(img1, img2, max_val=1.0):
     with ops.control_dependencies(checks):
         img1 = array_ops.identity(img1)
 
-    kernel = _fspecial_gauss(filter_size, filter_sigma)
-    kernel = array_ops.tile(kernel, multiples=[1, 1, shape1[-1], 1])
+    kernel = _fspecial_gauss_1d(filter_size, filter_sigma)
+    kernel_v = array_ops.reshape(kernel, shape=[filter_size, 1, 1, 1])
+    kernel_h = array_ops.reshape(kernel, shape=[1, filter_size, 1, 1])
 
     compensation = 1.0
 
+    # Gaussian filtering as two 1-D passes over every stacked channel.
     def reducer(x):
         shape = array_ops.shape(x)
         x = array_ops.reshape(x, shape=array_ops.concat([[-1], shape[-3:]], 0))
-        y = nn.depthwise_conv2d(x, kernel, strides=[1, 1, 1, 1], padding='VALID')
+        multiples = tf.stack([1, 1, shape[-1], 1])
+        y = nn.depthwise_conv2d(x, array_ops.tile(kernel_v, multiples), strides=[1, 1, 1, 1], padding='VALID')
+        y = nn.depthwise_conv2d(y, array_ops.tile(kernel_h, multiples), strides=[1, 1, 1, 1], padding='VALID')
         return array_ops.reshape(y, array_ops.concat([shape[:-3],
                                                       array_ops.shape(y)[1:]], 0))
 
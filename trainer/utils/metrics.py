@@ -0,0 +1,70 @@
+import tensorflow as tf
+from utils.custom_ssim import fspecial_gauss_1d
+
+_SSIM_K1 = 0.01
+_SSIM_K2 = 0.03
+
+''' Single-pass image metrics. Every statistic comes from one stacked moment tensor,
+    filtered once with the SSIM Gaussian and reduced once globally. '''
+def fused_metrics(x, y, max_val=1.0, filter_size=11, filter_sigma=1.5):
+    """Per-image mse, mae, ssim, contrast_structure, luminance, psnr and corr of [B, H, W, C] batches"""
+    x = tf.cast(x, tf.float32)
+    y = tf.cast(y, tf.float32)
+    channels = tf.shape(x)[-1]
+    diff = x - y
+
+    # Moments stacked as [x, y, x*x, y*y, x*y] blocks of C channels
+    moments = tf.concat([x, y, x * x, y * y, x * y], axis=-1)
+    kernel = fspecial_gauss_1d(filter_size, tf.constant(filter_sigma, tf.float32))
+    kernel_v = tf.tile(tf.reshape(kernel, [filter_size, 1, 1, 1]), [1, 1, 5 * channels, 1])
+    kernel_h = tf.tile(tf.reshape(kernel, [1, filter_size, 1, 1]), [1, 1, 5 * channels, 1])
+    local = tf.nn.depthwise_conv2d(moments, kernel_v, strides=[1, 1, 1, 1], padding='VALID')
+    local = tf.nn.depthwise_conv2d(local, kernel_h, strides=[1, 1, 1, 1], padding='VALID')
+    mu_x, mu_y, xx, yy, xy = tf.split(local, 5, axis=-1)
+
+    c1 = (_SSIM_K1 * max_val) ** 2
+    c2 = (_SSIM_K2 * max_val) ** 2
+    num0 = mu_x * mu_y * 2.0
+    den0 = tf.square(mu_x) + tf.square(mu_y)
+    luminance = (num0 + c1) / (den0 + c1)
+    cs = (xy * 2.0 - num0 + c2) / (xx + yy - den0 + c2)
+
+    # Global means of the same moments plus the error terms
+    stats = tf.reduce_mean(tf.concat([moments, tf.abs(diff), tf.square(diff)], axis=-1), axis=[1, 2])
+    g_x, g_y, g_xx, g_yy, g_xy, g_abs, g_sq = tf.split(stats, 7, axis=-1)
+    corr = (g_xy - g_x * g_y) / tf.sqrt((g_xx - tf.square(g_x)) * (g_yy - tf.square(g_y)))
+    mse = tf.reduce_mean(g_sq, -1)
+
+    return {
+        'mse': mse,
+        'mae': tf.reduce_mean(g_abs, -1),
+        'ssim': tf.reduce_mean(luminance * cs, [1, 2, 3]),
+        'contrast_structure': tf.reduce_mean(cs, [1, 2, 3]),
+        'luminance': tf.reduce_mean(luminance, [1, 2, 3]),
+        'psnr': 10 * tf.math.log(max_val ** 2 / mse) / tf.math.log(10.0),
+        'corr': tf.reduce_mean(corr, -1),
+    }
+
+class FusedImageMetrics(tf.keras.metrics.Metric):
+    """Keras metric reporting several fused_metrics keys from a single pass, e.g.
+    model.compile(..., metrics=[FusedImageMetrics()])"""
+    def __init__(self, keys=('mae', 'mse', 'ssim', 'psnr'), max_val=1.0, name='fused_image_metrics', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.keys = list(keys)
+        self.max_val = max_val
+        self.totals = [self.add_weight(name=key, initializer='zeros') for key in self.keys]
+        self.count = self.add_weight(name='count', initializer='zeros')
+
+    def update_state(self, y_true, y_pred, sample_weight=None):
+        metrics = fused_metrics(y_true, y_pred, self.max_val)
+        for key, total in zip(self.keys, self.totals):
+            total.assign_add(tf.reduce_sum(metrics[key]))
+        self.count.assign_add(tf.cast(tf.shape(y_true)[0], tf.float32))
+
+    def result(self):
+        return {key: total / self.count for key, total in zip(self.keys, self.totals)}
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'keys': self.keys, 'max_val': self.max_val})
+        return config
@@ -0,0 +1,17 @@
+import tensorflow as tf
+
+PRECISIONS = ['float32', 'mixed_float16', 'mixed_bfloat16']
+
+''' Sets the global Keras policy, call before building the model. Variables stay float32 under both mixed policies. '''
+def set_precision(precision='float32'):
+    if precision not in PRECISIONS:
+        raise ValueError('precision must be one of {}'.format(PRECISIONS))
+    tf.keras.mixed_precision.set_global_policy(precision)
+
+''' Adam with dynamic loss scaling under mixed_float16, whose small gradients would underflow.
+    bfloat16 keeps the float32 exponent range and needs no scaling. '''
+def make_optimizer(learning_rate, precision='float32'):
+    optimizer = tf.keras.optimizers.Adam(learning_rate)
+    if precision == 'mixed_float16':
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    return optimizer
@@ -0,0 +1,220 @@
+""" Per-layer cost profiler for MimickNet variants: FLOPs, parameters, activation memory and CPU latency.
+
+Run from the trainer directory, e.g.
+    python -m utils.profiler --models ../example_models/*.h5 --height 512 --width 512 --out profile.json
+    python -m utils.profiler --builders Conv:16,16,16,16,16:3x3 SepConv:32,32,32,32,32:5x5 --out profile.json
+
+Keras latency is timed layer by layer. TFLite per-op latency needs the TFLite benchmark_model
+binary (--benchmark_model), without it only the whole-model TFLite latency is reported.
+"""
+
+import os
+import csv
+import glob
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+_SUMMARY_FIELDNAMES = ['model', 'height', 'width', 'params', 'gflops', 'activation_mb', 'peak_activation_mb',
+                       'keras_ms', 'keras_layers_ms', 'tflite_ms', 'tflite_ops_ms']
+
+
+def build_model(conv_type='Conv', filters=(16, 16, 16, 16, 16), filter_shape=(3, 3)):
+    if conv_type == 'Conv':
+        from models.MimickNet_Conv import MimickNet_Conv as MimickNet
+    elif conv_type == 'SepConv':
+        from models.MimickNet_SepConv import MimickNet_SepConv as MimickNet
+    else:
+        raise ValueError('conv_type must be Conv or SepConv, not {}'.format(conv_type))
+    return MimickNet(shape=(None, None, 1), Activation=tf.keras.layers.ReLU(),
+                     filters=list(filters), filter_shape=tuple(filter_shape)).load_model()
+
+
+def parse_builder(spec):
+    """'SepConv:16,16,16,16,16:3x3' -> ('SepConv', [16, 16, 16, 16, 16], (3, 3))"""
+    conv_type, filters, filter_shape = spec.split(':')
+    return conv_type, [int(f) for f in filters.split(',')], tuple(int(k) for k in filter_shape.split('x'))
+
+
+def layer_flops(layer, input_shapes, output_shape):
+    """Multiply-adds count as two FLOPs, elementwise ops as one"""
+    output_size = int(np.prod(output_shape[1:]))
+    if isinstance(layer, tf.keras.layers.SeparableConv2D):
+        kh, kw = layer.kernel_size
+        cin = input_shapes[0][-1]
+        spatial = output_shape[1] * output_shape[2]
+        depthwise = 2 * spatial * kh * kw * cin * layer.depth_multiplier
+        pointwise = 2 * spatial * cin * layer.depth_multiplier * layer.filters
+        return depthwise + pointwise + (output_size if layer.use_bias else 0)
+    if isinstance(layer, tf.keras.layers.Conv2DTranspose):
+        kh, kw = layer.kernel_size
+        input_spatial = input_shapes[0][1] * input_shapes[0][2]
+        return 2 * input_spatial * kh * kw * input_shapes[0][-1] * layer.filters + (output_size if layer.use_bias else 0)
+    if isinstance(layer, tf.keras.layers.DepthwiseConv2D):
+        kh, kw = layer.kernel_size
+        return 2 * output_size * kh * kw + (output_size if layer.use_bias else 0)
+    if isinstance(layer, tf.keras.layers.Conv2D):
+        kh, kw = layer.kernel_size
+        return 2 * output_size * kh * kw * input_shapes[0][-1] + (output_size if layer.use_bias else 0)
+    if isinstance(layer, tf.keras.layers.Dense):
+        return 2 * output_size * input_shapes[0][-1] + (output_size if layer.use_bias else 0)
+    if isinstance(layer, (tf.keras.layers.MaxPool2D, tf.keras.layers.AveragePooling2D)):
+        return output_size * int(np.prod(layer.pool_size))
+    if isinstance(layer, (tf.keras.layers.Activation, tf.keras.layers.ReLU)):
+        return output_size
+    # Concatenate, InputLayer and reshapes only move memory
+    return 0
+
+
+def time_call(fn, args, warmup=3, runs=20):
+    for _ in range(warmup):
+        fn(*args)
+    latencies = []
+    for _ in range(runs):
+        t_start = time.perf_counter()
+        result = fn(*args)
+        if hasattr(result, 'numpy'):
+            result.numpy()
+        latencies.append(time.perf_counter() - t_start)
+    return float(np.median(latencies) * 1000)
+
+
+def profile_keras(model, height, width, warmup=3, runs=20, time_layers=True):
+    """Per-layer rows of a flat functional model, each layer timed on its real inputs unless time_layers is off"""
+    image = tf.random.uniform((1, height, width, 1))
+    probe = tf.keras.Model(model.inputs, [layer.output for layer in model.layers])
+    values = dict(zip([layer.name for layer in model.layers], probe(image)))
+
+    rows = []
+    for layer in model.layers:
+        output = values[layer.name]
+        row = {'layer': layer.name, 'type': type(layer).__name__, 'output_shape': list(output.shape),
+               'params': int(layer.count_params()), 'activation_mb': output.numpy().nbytes / 2**20}
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            row.update({'flops': 0, 'keras_ms': 0.0})
+        else:
+            inbound = layer.inbound_nodes[0].inbound_layers
+            inputs = [values[l.name] for l in inbound] if isinstance(inbound, list) else values[inbound.name]
+            input_shapes = [i.shape for i in inputs] if isinstance(inputs, list) else [inputs.shape]
+            row['flops'] = int(layer_flops(layer, input_shapes, output.shape))
+            row['keras_ms'] = time_call(tf.function(layer), (inputs,), warmup, runs) if time_layers else None
+        rows.append(row)
+    return rows
+
+
+def peak_live_activation_mb(model, rows):
+    """Largest sum of live layer outputs when layers run in model.layers order. An output is live from
+    its layer until its last consumer, so encoder skips count until their decoder concatenate."""
+    index = {layer.name: i for i, layer in enumerate(model.layers)}
+    last_use = list(range(len(model.layers)))
+    for i, layer in enumerate(model.layers):
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            continue
+        inbound = layer.inbound_nodes[0].inbound_layers
+        for parent in inbound if isinstance(inbound, list) else [inbound]:
+            last_use[index[parent.name]] = i
+    for name in model.output_names:
+        last_use[index[name]] = len(model.layers) - 1
+    return max(sum(rows[j]['activation_mb'] for j in range(i + 1) if last_use[j] >= i)
+               for i in range(len(model.layers)))
+
+
+def model_flops(model, height, width):
+    return sum(row['flops'] for row in profile_keras(model, height, width, time_layers=False))
+
+
+def fixed_shape_model(model, height, width):
+    inputs = tf.keras.layers.Input(shape=(height, width, 1), batch_size=1)
+    return tf.keras.Model(inputs, model(inputs))
+
+
+def profile_tflite(model, height, width, benchmark_model=None, num_threads=1, warmup=3, runs=20):
+    """Whole-model TFLite latency, plus per-op rows when the benchmark_model binary is available"""
+    from utils.tflite import convert_tflite, load_interpreter, ZeroCopyRunner
+    tflite_model = convert_tflite(fixed_shape_model(model, height, width))
+    runner = ZeroCopyRunner(load_interpreter(tflite_model, num_threads=num_threads), (1, height, width, 1))
+    latency = time_call(runner, (np.random.uniform(size=(1, height, width, 1)),), warmup, runs)
+    if not benchmark_model:
+        return latency, []
+
+    with tempfile.NamedTemporaryFile(suffix='.tflite') as f:
+        f.write(tflite_model)
+        f.flush()
+        result = subprocess.run([benchmark_model, '--graph={}'.format(f.name), '--num_threads={}'.format(num_threads),
+                                 '--warmup_runs={}'.format(warmup), '--num_runs={}'.format(runs),
+                                 '--enable_op_profiling=true'], capture_output=True, text=True, check=True)
+    return latency, parse_op_profile(result.stdout + result.stderr)
+
+
+def parse_op_profile(output):
+    """Rows of the 'Run Order' table printed by benchmark_model --enable_op_profiling"""
+    rows = []
+    lines = iter(output.splitlines())
+    for line in lines:
+        if 'Run Order' in line:
+            break
+    next(lines, None)  # column header
+    for line in lines:
+        columns = line.split('\t')
+        columns = [column.strip() for column in columns if column.strip()]
+        if len(columns) < 8:
+            break
+        rows.append({'op': columns[0], 'avg_ms': float(columns[2]), 'percent': float(columns[3].rstrip('%')),
+                     'name': columns[-1]})
+    return rows
+
+
+def profile(model, name, height=512, width=512, benchmark_model=None, num_threads=1, warmup=3, runs=20):
+    layers = profile_keras(model, height, width, warmup, runs)
+    predict = tf.function(model)
+    image = tf.random.uniform((1, height, width, 1))
+    tflite_ms, ops = profile_tflite(model, height, width, benchmark_model, num_threads, warmup, runs)
+    summary = {
+        'model': name, 'height': height, 'width': width,
+        'params': int(model.count_params()),
+        'gflops': sum(row['flops'] for row in layers) / 1e9,
+        'activation_mb': sum(row['activation_mb'] for row in layers),
+        'peak_activation_mb': peak_live_activation_mb(model, layers),
+        'keras_ms': time_call(predict, (image,), warmup, runs),
+        'keras_layers_ms': sum(row['keras_ms'] for row in layers),
+        'tflite_ms': tflite_ms,
+        'tflite_ops_ms': sum(row['avg_ms'] for row in ops) if ops else None,
+    }
+    print(summary)
+    return {'summary': summary, 'layers': layers, 'tflite_ops': ops}
+
+
+def write_report(reports, out):
+    """Full per-layer report as JSON, and a comparable one row per model summary CSV next to it"""
+    with open(out, 'w') as f:
+        json.dump(reports, f, indent=2)
+    with open(os.path.splitext(out)[0] + '_summary.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=_SUMMARY_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows([report['summary'] for report in reports])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', nargs='*', default=sorted(glob.glob('../example_models/*.h5')), help='.h5 model filepaths')
+    parser.add_argument('--builders', nargs='*', default=[], help='builder configs as conv_type:filters:kernel, e.g. SepConv:16,16,16,16,16:3x3')
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--threads', type=int, default=1, help='intra-op and TFLite threads')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed runs per measurement')
+    parser.add_argument('--runs', type=int, default=20, help='timed runs per measurement, the median is reported')
+    parser.add_argument('--benchmark_model', default=None, help='TFLite benchmark_model binary for per-op latency')
+    parser.add_argument('--out', default='profile.json', help='JSON report, a _summary.csv is written next to it')
+    args = parser.parse_args()
+
+    tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    models = [(os.path.basename(path), lambda path=path: tf.keras.models.load_model(path, compile=False))
+              for path in args.models]
+    models += [(spec, lambda spec=spec: build_model(*parse_builder(spec))) for spec in args.builders]
+    reports = [profile(load(), name, args.height, args.width, args.benchmark_model, args.threads, args.warmup, args.runs)
+               for name, load in models]
+    write_report(reports, args.out)
@@ -0,0 +1,116 @@
+import math
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Conv2D, SeparableConv2D, Conv2DTranspose, Concatenate, InputLayer
+
+''' Convolutions whose output channels can be removed, every one except the 1x1 output head '''
+def prunable_layers(model):
+    convs = [layer for layer in model.layers if isinstance(layer, (Conv2D, SeparableConv2D))]
+    return [layer for layer in convs if layer is not convs[-1]]
+
+''' L1 norm of every output filter, normalized by the layer mean so layers can be ranked against each other '''
+def channel_scores(layer):
+    if isinstance(layer, SeparableConv2D):
+        _, pointwise = layer.get_weights()[:2]
+        scores = np.abs(pointwise).sum(axis=(0, 1, 2))
+    elif isinstance(layer, Conv2DTranspose):
+        scores = np.abs(layer.get_weights()[0]).sum(axis=(0, 1, 3))
+    else:
+        scores = np.abs(layer.get_weights()[0]).sum(axis=(0, 1, 2))
+    return scores / scores.mean()
+
+def inbound(layer):
+    layers = layer.inbound_nodes[0].inbound_layers
+    return layers if isinstance(layers, list) else [layers]
+
+''' Original channel indices surviving at every layer output, in the order the pruned model lays them out.
+    A concatenate keeps the kept skip channels offset behind the kept upsampled ones, so decoder convs
+    slice exactly the inputs that survive on both paths. '''
+def propagate(model, kept):
+    channels = {}
+    for layer in model.layers:
+        if isinstance(layer, InputLayer):
+            channels[layer.name] = np.arange(layer.output.shape[-1])
+        elif layer.name in kept:
+            channels[layer.name] = kept[layer.name]
+        elif isinstance(layer, Concatenate):
+            indices, offset = [], 0
+            for parent in inbound(layer):
+                indices.append(channels[parent.name] + offset)
+                offset += parent.output.shape[-1]
+            channels[layer.name] = np.concatenate(indices)
+        elif isinstance(layer, (Conv2D, SeparableConv2D)):
+            channels[layer.name] = np.arange(layer.filters)
+        else:
+            # Activations, pooling and casts keep their input channels
+            channels[layer.name] = channels[inbound(layer)[0].name]
+    return channels
+
+def slice_weights(layer, weights, in_idx, out_idx):
+    if isinstance(layer, SeparableConv2D):
+        depthwise, pointwise = weights[:2]
+        multiplier = depthwise.shape[-1]
+        rows = (in_idx[:, None] * multiplier + np.arange(multiplier)).reshape(-1)
+        sliced = [depthwise[:, :, in_idx, :], pointwise[:, :, rows, :][..., out_idx]]
+    elif isinstance(layer, Conv2DTranspose):
+        sliced = [weights[0][:, :, out_idx, :][..., in_idx]]
+    else:
+        sliced = [weights[0][:, :, in_idx, :][..., out_idx]]
+    if layer.use_bias:
+        sliced.append(weights[-1][out_idx])
+    return sliced
+
+''' Smaller copy of a flat MimickNet model keeping only the kept output channels of each prunable layer '''
+def apply_pruning(model, kept):
+    def clone(layer):
+        config = layer.get_config()
+        if layer.name in kept:
+            config['filters'] = len(kept[layer.name])
+        return layer.__class__.from_config(config)
+
+    pruned = tf.keras.models.clone_model(model, clone_function=clone)
+    channels = propagate(model, kept)
+    for layer in model.layers:
+        if not layer.get_weights():
+            continue
+        if isinstance(layer, (Conv2D, SeparableConv2D)):
+            weights = slice_weights(layer, layer.get_weights(), channels[inbound(layer)[0].name], channels[layer.name])
+        else:
+            weights = layer.get_weights()
+        pruned.get_layer(layer.name).set_weights(weights)
+    return pruned
+
+def prune_step(kept, scores, fraction, min_channels=2):
+    """Drops the lowest scoring fraction of the remaining channels across all layers, keeping min_channels each"""
+    candidates = [(scores[name][index], name, index) for name, indices in kept.items()
+                  if len(indices) > min_channels for index in indices]
+    budget = {name: len(indices) - min_channels for name, indices in kept.items()}
+    remove = {name: set() for name in kept}
+    count = math.ceil(fraction * sum(len(indices) for indices in kept.values()))
+    for score, name, index in sorted(candidates):
+        if count == 0:
+            break
+        if len(remove[name]) < budget[name]:
+            remove[name].add(index)
+            count -= 1
+    return {name: np.array([index for index in indices if index not in remove[name]]) for name, indices in kept.items()}
+
+def prune_to_budget(model, cost_fn, target, fraction=0.05, min_channels=2):
+    """Prunes in fraction sized steps until cost_fn(pruned model) <= target or nothing is left to remove.
+    Channels are ranked once on the trained weights, the pruned weights are slices of them."""
+    layers = prunable_layers(model)
+    scores = {layer.name: channel_scores(layer) for layer in layers}
+    kept = {layer.name: np.arange(layer.filters) for layer in layers}
+    pruned = model
+    cost = cost_fn(model)
+    print('Cost before pruning: {:.4f}, target {:.4f}'.format(cost, target))
+    while cost > target:
+        next_kept = prune_step(kept, scores, fraction, min_channels)
+        if all(len(next_kept[name]) == len(kept[name]) for name in kept):
+            print('Every layer is down to {} channels, stopping at cost {:.4f}'.format(min_channels, cost))
+            break
+        kept = next_kept
+        pruned = apply_pruning(model, kept)
+        cost = cost_fn(pruned)
+        print('Channels {} - cost {:.4f}'.format(sum(len(indices) for indices in kept.values()), cost))
+    return pruned, kept
@@ -0,0 +1,12 @@
+try:
+    import tensorflow_model_optimization as tfmot
+except ImportError:
+    tfmot = None
+
+''' Wraps a trained MimickNet_Conv / MimickNet_SepConv graph with fake-quant nodes for quantization-aware training.
+    Every layer is annotated, including the Conv2DTranspose upsampling and the concatenate skip paths. '''
+def quantize_model(model):
+    if tfmot is None:
+        raise ImportError('Quantization-aware training needs tensorflow-model-optimization, '
+                          'pip install tensorflow-model-optimization')
+    return tfmot.quantization.keras.quantize_model(model)
@@ -1,6 +1,15 @@
+import math
+import collections
+import numpy as np
 import tensorflow as tf
-import tensorflow_addons as tfa
-import polarTransform
+try:
+    import tensorflow_addons as tfa
+except ImportError:
+    tfa = None
+try:
+    import polarTransform
+except ImportError:
+    polarTransform = None
 
 # Original Scan Convert function
 def scan_convert_old_helper(image, irad, frad, iang, fang):
@@ -91,3 +100,201 @@ def fan_out_tf(image_padded, start_points, end_points, irad, frad):
     # Masking result image
     res = tf.where(mask, res, zeros)
     return res[:,irad:,:,:]
+
+
+
+
+
+# Lookup table Scan Convert function
+class GeometryCache():
+    """LRU cache of scan conversion lookup tables keyed by probe geometry"""
+    def __init__(self, build_fn, max_entries=8):
+        self.build_fn = build_fn
+        self.max_entries = max_entries
+        self.tables = collections.OrderedDict()
+
+    def get(self, height, width, irad, frad, iang, fang):
+        key = geometry_key(height, width, irad, frad, iang, fang)
+        if key in self.tables:
+            self.tables.move_to_end(key)
+            return self.tables[key]
+        table = self.build_fn(*key)
+        self.tables[key] = table
+        if len(self.tables) > self.max_entries:
+            self.tables.popitem(last=False)
+        return table
+
+    def clear(self):
+        self.tables.clear()
+
+def geometry_key(height, width, irad, frad, iang, fang):
+    """Hashable key of beam line shape and probe geometry"""
+    return (int(height), int(width),
+            round(float(irad), 4), round(float(frad), 4),
+            round(float(iang), 6), round(float(fang), 6))
+
+def get_geometry(ele):
+    return (ele['initial_radius'], ele['final_radius'],
+            ele['initial_angle'], ele['final_angle'])
+
+def scan_convert_shape(irad, frad, iang, fang):
+    """Output [height, width] of a scan converted frame, cropped at irad like scan_convert_old"""
+    half_width = frad * max(abs(math.sin(iang)), abs(math.sin(fang)))
+    return int(math.ceil(frad - irad)), int(math.ceil(2 * half_width))
+
+def polar_sample_grid_tf(y, x, height, width, irad, frad, iang, fang):
+    """Bilinear beam line taps for cartesian points (y, x) measured from the apex.
+
+    All arguments broadcast, so geometry may be scalars or per-sample tensors.
+    Returns flat source indices [..., 4] into a [height*width] beam line image
+    and matching bilinear weights [..., 4] with the fan mask folded in.
+    """
+    max_row = tf.cast(height - 1, tf.float32)
+    max_col = tf.cast(width - 1, tf.float32)
+    radius = tf.sqrt(x**2 + y**2)
+    # TFLite ATAN2 does not broadcast its operands
+    theta = tf.atan2(tf.broadcast_to(x, tf.shape(radius)), tf.broadcast_to(y, tf.shape(radius)))
+
+    # Fractional beam line coordinates
+    row = (radius - irad) / (frad - irad) * max_row
+    col = (theta - iang) / (fang - iang) * max_col
+    mask = (row >= 0) & (row <= max_row) & (col >= 0) & (col <= max_col)
+    mask = tf.cast(mask, tf.float32)
+
+    row = tf.clip_by_value(row, 0, max_row)
+    col = tf.clip_by_value(col, 0, max_col)
+    row0, col0 = tf.floor(row), tf.floor(col)
+    dr, dc = row - row0, col - col0
+    row0, col0 = tf.cast(row0, tf.int32), tf.cast(col0, tf.int32)
+    row1 = tf.minimum(row0 + 1, height - 1)
+    col1 = tf.minimum(col0 + 1, width - 1)
+
+    indices = tf.stack([row0*width + col0, row0*width + col1,
+                        row1*width + col0, row1*width + col1], axis=-1)
+    weights = tf.stack([(1-dr)*(1-dc), (1-dr)*dc, dr*(1-dc), dr*dc], axis=-1) * tf.expand_dims(mask, axis=-1)
+    return indices, weights
+
+def build_lut_tf(height, width, irad, frad, iang, fang):
+    """Dense polar-to-cartesian sampling grid of one probe geometry.
+
+    Returns indices and weights flattened to [out_h*out_w, 4] and the output shape.
+    """
+    out_h, out_w = scan_convert_shape(irad, frad, iang, fang)
+
+    # Cartesian grid with the apex at the top center, depth starting at irad
+    y = tf.range(out_h, dtype=tf.float32) + irad
+    x = tf.range(out_w, dtype=tf.float32) - out_w/2 + 0.5
+    x, y = tf.meshgrid(x, y)
+    indices, weights = polar_sample_grid_tf(y, x, height, width, irad, frad, iang, fang)
+    return tf.reshape(indices, [-1, 4]), tf.reshape(weights, [-1, 4]), (out_h, out_w)
+
+lut_cache = GeometryCache(build_lut_tf)
+
+def apply_lut_tf(image, indices, weights, out_shape):
+    """Scan converts [B, H, W, C] beam lines with a single gather"""
+    shape = tf.shape(image)
+    flat = tf.reshape(image, [shape[0], shape[1]*shape[2], shape[3]])
+    samples = tf.gather(flat, indices, axis=1)
+    res = tf.reduce_sum(samples * weights[None, :, :, None], axis=2)
+    return tf.reshape(res, [shape[0], out_shape[0], out_shape[1], shape[3]])
+
+def scan_convert_lut(image, ele, cache=lut_cache):
+    """Scan converts [B, H, W, C] beam lines with the cached lookup table of the probe geometry.
+    The output is [B, ceil(frad - irad), ceil(2*frad*max|sin(angle)|), C], see scan_convert_shape,
+    not the H x padded width frame of scan_convert_new."""
+    irad, frad, iang, fang = [float(v) for v in get_geometry(ele)]
+    indices, weights, out_shape = cache.get(image.shape[1], image.shape[2], irad, frad, iang, fang)
+    return apply_lut_tf(image, indices, weights, out_shape)
+
+
+
+
+
+# NumPy Scan Convert function
+def build_lut_np(height, width, irad, frad, iang, fang):
+    """NumPy equivalent of build_lut_tf for CPU-only hosts"""
+    out_h, out_w = scan_convert_shape(irad, frad, iang, fang)
+
+    y = np.arange(out_h, dtype=np.float32) + np.float32(irad)
+    x = np.arange(out_w, dtype=np.float32) - np.float32(out_w/2 - 0.5)
+    x, y = np.meshgrid(x, y)
+    radius = np.sqrt(x**2 + y**2)
+    theta = np.arctan2(x, y)
+
+    row = (radius - irad) / (frad - irad) * (height - 1)
+    col = (theta - iang) / (fang - iang) * (width - 1)
+    mask = (row >= 0) & (row <= height - 1) & (col >= 0) & (col <= width - 1)
+
+    row = np.clip(row, 0, height - 1)
+    col = np.clip(col, 0, width - 1)
+    row0, col0 = np.floor(row), np.floor(col)
+    dr, dc = (row - row0).astype(np.float32), (col - col0).astype(np.float32)
+    row0, col0 = row0.astype(np.intp), col0.astype(np.intp)
+    row1 = np.minimum(row0 + 1, height - 1)
+    col1 = np.minimum(col0 + 1, width - 1)
+
+    indices = np.stack([row0*width + col0, row0*width + col1,
+                        row1*width + col0, row1*width + col1], axis=-1)
+    weights = np.stack([(1-dr)*(1-dc), (1-dr)*dc, dr*(1-dc), dr*dc], axis=-1) * mask[..., None]
+    return indices.reshape(-1, 4), weights.reshape(-1, 4).astype(np.float32), (out_h, out_w)
+
+lut_cache_np = GeometryCache(build_lut_np)
+
+def apply_lut_np(images, indices, weights, out_shape):
+    """Scan converts a [N, H, W] stack of beam lines in one vectorized call"""
+    images = np.asarray(images, dtype=np.float32)
+    flat = images.reshape(images.shape[0], -1)
+    res = np.einsum('npk,pk->np', flat[:, indices], weights)
+    return res.reshape(images.shape[0], out_shape[0], out_shape[1])
+
+def scan_convert_np(images, irad, frad, iang, fang, cache=lut_cache_np):
+    """Scan converts [H, W] or [N, H, W] beam lines without polarTransform"""
+    images = np.asarray(images, dtype=np.float32)
+    single = images.ndim == 2
+    if single:
+        images = images[None]
+    indices, weights, out_shape = cache.get(images.shape[1], images.shape[2], irad, frad, iang, fang)
+    res = apply_lut_np(images, indices, weights, out_shape)
+    return res[0] if single else res
+
+
+
+
+
+# Batched Scan Convert function
+@tf.function(input_signature=[tf.TensorSpec(shape=[None, None, None, 1], dtype=tf.float32),
+                              tf.TensorSpec(shape=[None, 4], dtype=tf.float32)])
+def scan_convert_batch(image, geometry):
+    """Scan converts [B, H, W, 1] beam lines in one graph.
+
+    geometry holds [initial_radius, final_radius, initial_angle, final_angle]
+    per sample. The output canvas fits the largest fan of the batch, smaller
+    fans are zero filled.
+    """
+    shape = tf.shape(image)
+    batch, height, width = shape[0], shape[1], shape[2]
+    irad, frad, iang, fang = [tf.reshape(geometry[:, i], [-1, 1, 1]) for i in range(4)]
+
+    half_width = frad * tf.maximum(tf.abs(tf.sin(iang)), tf.abs(tf.sin(fang)))
+    out_h = tf.cast(tf.math.ceil(tf.reduce_max(frad - irad)), tf.int32)
+    out_w = tf.cast(tf.math.ceil(tf.reduce_max(2 * half_width)), tf.int32)
+
+    y = tf.range(out_h, dtype=tf.float32)[None, :, None] + irad
+    x = tf.range(out_w, dtype=tf.float32)[None, None, :] - tf.cast(out_w, tf.float32)/2 + 0.5
+    indices, weights = polar_sample_grid_tf(y, x, height, width, irad, frad, iang, fang)
+
+    flat = tf.reshape(image, [batch, height*width])
+    samples = tf.gather(flat, tf.reshape(indices, [batch, -1]), batch_dims=1)
+    res = tf.reduce_sum(tf.reshape(samples, [batch, out_h, out_w, 4]) * weights, axis=-1)
+    return tf.expand_dims(res, axis=-1)
+
+def stack_geometry(ele):
+    """[B, 4] geometry tensor from a batched dataset element"""
+    geometry = [tf.reshape(tf.cast(v, tf.float32), [-1]) for v in get_geometry(ele)]
+    return tf.stack(geometry, axis=-1)
+
+class ScanConvert(tf.keras.layers.Layer):
+    """Keras layer wrapping scan_convert_batch, called on [image, geometry]"""
+    def call(self, inputs):
+        image, geometry = inputs
+        return scan_convert_batch(image, geometry)
@@ -0,0 +1,155 @@
+import numpy as np
+import tensorflow as tf
+
+QUANT_MODES = ['float32', 'dynamic', 'float16', 'int8', 'int8_full']
+
+''' Converts a Keras model to TFLite with the given post-training quantization mode '''
+def convert_tflite(model, mode='float32', representative_dataset=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode != 'float32':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'qat':
+        # Fake-quant ranges come from training, no calibration needed
+        pass
+    elif mode in ('int8', 'int8_full'):
+        if representative_dataset is None:
+            raise ValueError('{} quantization needs a representative dataset'.format(mode))
+        converter.representative_dataset = representative_dataset
+    if mode == 'int8_full':
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    if mode in ('int8_full', 'qat'):
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+''' Yields single [1, H, W, 1] DAS frames from a batched (das, dtce) dataset for calibration '''
+def make_representative_dataset(dataset, num_samples=100):
+    def representative_dataset():
+        count = 0
+        for das, _ in dataset:
+            for image in das:
+                if count >= num_samples:
+                    return
+                count += 1
+                yield [tf.cast(image[None], tf.float32)]
+    return representative_dataset
+
+''' Runs one [B, H, W, 1] float batch through an interpreter, (de)quantizing int8 inputs and outputs '''
+def run_tflite(interpreter, image):
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    image = np.asarray(image, dtype=np.float32)
+    if tuple(input_details['shape']) != image.shape:
+        interpreter.resize_tensor_input(input_details['index'], image.shape)
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+
+    if input_details['dtype'] == np.int8:
+        scale, zero_point = input_details['quantization']
+        image = np.clip(np.round(image / scale + zero_point), -128, 127).astype(np.int8)
+    interpreter.set_tensor(input_details['index'], image)
+    interpreter.invoke()
+    output = interpreter.get_tensor(output_details['index'])
+    if output_details['dtype'] == np.int8:
+        scale, zero_point = output_details['quantization']
+        output = (output.astype(np.float32) - zero_point) * scale
+    return output
+
+def load_interpreter(tflite_model, num_threads=None):
+    """Interpreter from a .tflite path or serialized model bytes"""
+    if isinstance(tflite_model, (bytes, bytearray)):
+        interpreter = tf.lite.Interpreter(model_content=bytes(tflite_model), num_threads=num_threads)
+    else:
+        interpreter = tf.lite.Interpreter(model_path=tflite_model, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    return interpreter
+
+''' Normalizes DAS dB frames in place, clipping to [clip, 0] then scaling each frame to [0, 1] '''
+def normalize_db_(das, clip=-80.0, out=None):
+    out = das if out is None else out
+    np.clip(das, clip, 0, out=out)
+    axes = tuple(range(out.ndim - 2, out.ndim))
+    das_min = out.min(axis=axes, keepdims=True)
+    out -= das_min
+    out /= out.max(axis=axes, keepdims=True)
+    return out
+
+class FrameRing():
+    """Pre-allocated ring of [H, W] float32 frames, so normalization never allocates per frame.
+    A slot is overwritten once the ring wraps around, copy frames that must outlive it."""
+    def __init__(self, shape, size=8):
+        self.frames = np.empty((size,) + tuple(shape), dtype=np.float32)
+        self.position = 0
+
+    def next(self):
+        frame = self.frames[self.position]
+        self.position = (self.position + 1) % len(self.frames)
+        return frame
+
+    def normalize(self, das, clip=-80.0):
+        return normalize_db_(das, clip, out=self.next())
+
+class ZeroCopyRunner():
+    """Runs one fixed input shape through an interpreter, writing straight into its input buffer
+    through tensor() views and dequantizing into a reused output buffer.
+
+    The returned array is overwritten by the next call, copy it if it must be kept.
+    No tensor() view may outlive a call, the interpreter refuses to invoke while one exists."""
+    def __init__(self, interpreter, shape):
+        self.interpreter = interpreter
+        input_details = interpreter.get_input_details()[0]
+        if tuple(input_details['shape']) != tuple(shape):
+            interpreter.resize_tensor_input(input_details['index'], shape)
+            interpreter.allocate_tensors()
+        self.input_details = interpreter.get_input_details()[0]
+        self.output_details = interpreter.get_output_details()[0]
+        self.input = interpreter.tensor(self.input_details['index'])
+        self.output = interpreter.tensor(self.output_details['index'])
+        self.shape = tuple(self.input_details['shape'])
+        if self.shape != tuple(shape):
+            raise ValueError('Interpreter input is fixed to {}, cannot run {}'.format(self.shape, tuple(shape)))
+        # Dynamic output shapes are only resolved by invoke, the buffer is sized by the first output
+        self.output_buffer = None
+        # int8 models quantize through a float scratch buffer instead of a temporary per frame
+        self.scratch = np.empty(self.shape, dtype=np.float32) if self.input_details['dtype'] == np.int8 else None
+
+    def write_input(self, image):
+        view = self.input()
+        image = np.asarray(image, dtype=np.float32).reshape(self.shape)
+        if self.scratch is None:
+            np.copyto(view, image)
+        else:
+            scale, zero_point = self.input_details['quantization']
+            np.divide(image, scale, out=self.scratch)
+            self.scratch += zero_point
+            np.rint(self.scratch, out=self.scratch)
+            np.clip(self.scratch, -128, 127, out=self.scratch)
+            np.copyto(view, self.scratch, casting='unsafe')
+
+    def write_normalized(self, das, clip=-80.0):
+        """Normalizes a DAS dB frame directly into the float input buffer"""
+        if self.scratch is not None:
+            return self.write_input(normalize_db_(das, clip, out=self.scratch.reshape(np.shape(das))))
+        normalize_db_(das, clip, out=self.input().reshape(np.shape(das)))
+
+    def invoke(self):
+        self.interpreter.invoke()
+        view = self.output()
+        if self.output_buffer is None or self.output_buffer.shape != view.shape:
+            self.output_buffer = np.empty(view.shape, dtype=np.float32)
+        if self.output_details['dtype'] == np.int8:
+            scale, zero_point = self.output_details['quantization']
+            # Widen to float before subtracting, int8 arithmetic would wrap around
+            np.copyto(self.output_buffer, view, casting='unsafe')
+            self.output_buffer -= zero_point
+            self.output_buffer *= scale
+        else:
+            np.copyto(self.output_buffer, view)
+        return self.output_buffer
+
+    def __call__(self, image):
+        self.write_input(image)
+        return self.invoke()
@@ -0,0 +1,168 @@
+""" Pool of TFLite interpreters, one per worker thread, for multi-core throughput.
+
+An interpreter is not thread safe, so every worker owns its interpreters and is pinned to its own cores.
+
+    with InterpreterPool('../example_models/model.tflite', num_interpreters=4, shapes=[(1, 512, 512, 1)]) as pool:
+        output = pool.predict(batch)
+
+Scaling benchmark, from the trainer directory, e.g.
+    python -m utils.tflite_pool --model ../example_models/model.tflite --shape 1 512 512 1 --out pool.csv
+"""
+
+import os
+import csv
+import json
+import time
+import queue
+import argparse
+import itertools
+import threading
+import concurrent.futures
+import numpy as np
+from utils.tflite import load_interpreter, ZeroCopyRunner
+
+DISPATCH_MODES = ['round_robin', 'least_loaded']
+_FIELDNAMES = ['num_interpreters', 'threads_per_interpreter', 'dispatch', 'frames', 'seconds', 'frames_per_s', 'speedup']
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+class InterpreterWorker():
+    def __init__(self, model_path, num_threads, cores, shapes):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.cores = cores
+        self.shapes = shapes
+        self.runners = {}
+        self.queue = queue.Queue()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def runner(self, shape):
+        # One interpreter per shape, so alternating shapes never reallocate the tensor arena
+        if shape not in self.runners:
+            runner = ZeroCopyRunner(load_interpreter(self.model_path, num_threads=self.num_threads), shape)
+            runner(np.zeros(shape, dtype=np.float32))
+            self.runners[shape] = runner
+        return self.runners[shape]
+
+    def loop(self):
+        # On Linux this pins the calling thread, and the TFLite thread pool it spawns inherits the mask
+        if self.cores and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, self.cores)
+        for shape in self.shapes:
+            self.runner(tuple(shape))
+        self.ready.set()
+
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            batch, future = task
+            try:
+                # The runner reuses its output buffer, the future needs its own copy
+                future.set_result(self.runner(batch.shape)(batch).copy())
+            except Exception as e:
+                future.set_exception(e)
+            with self.lock:
+                self.pending -= 1
+
+    def submit(self, batch, future):
+        with self.lock:
+            self.pending += 1
+        self.queue.put((batch, future))
+
+
+class InterpreterPool():
+    def __init__(self, model_path, num_interpreters=None, threads_per_interpreter=1, shapes=(),
+                 dispatch='least_loaded', pin=True):
+        if dispatch not in DISPATCH_MODES:
+            raise ValueError('dispatch must be one of {}'.format(DISPATCH_MODES))
+        cores = available_cores()
+        num_interpreters = num_interpreters or max(len(cores) // threads_per_interpreter, 1)
+        self.dispatch = dispatch
+        self.workers = []
+        for i in range(num_interpreters):
+            # Workers get disjoint core sets while there are enough cores, then wrap around
+            worker_cores = [cores[(i*threads_per_interpreter + j) % len(cores)] for j in range(threads_per_interpreter)]
+            self.workers.append(InterpreterWorker(model_path, threads_per_interpreter,
+                                                  set(worker_cores) if pin else None, shapes))
+        self.round_robin = itertools.cycle(self.workers)
+        for worker in self.workers:
+            worker.ready.wait()
+
+    def next_worker(self):
+        if self.dispatch == 'round_robin':
+            return next(self.round_robin)
+        return min(self.workers, key=lambda worker: worker.pending)
+
+    def submit(self, batch):
+        """Queues one [B, H, W, 1] batch, returns a concurrent.futures.Future of the output"""
+        future = concurrent.futures.Future()
+        self.next_worker().submit(np.asarray(batch, dtype=np.float32), future)
+        return future
+
+    def predict(self, batch):
+        return self.submit(batch).result()
+
+    def close(self):
+        for worker in self.workers:
+            worker.queue.put(None)
+        for worker in self.workers:
+            worker.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def benchmark_scaling(model_path, shape, frames=200, counts=None, threads_per_interpreter=1, dispatch='least_loaded'):
+    """Throughput with 1 up to all cores worth of interpreters, all frames in flight at once"""
+    counts = counts or range(1, max(len(available_cores()) // threads_per_interpreter, 1) + 1)
+    batch = np.random.uniform(size=shape).astype(np.float32)
+    rows = []
+    for count in counts:
+        with InterpreterPool(model_path, count, threads_per_interpreter, [shape], dispatch) as pool:
+            t_start = time.perf_counter()
+            futures = [pool.submit(batch) for _ in range(frames)]
+            for future in futures:
+                future.result()
+            seconds = time.perf_counter() - t_start
+        row = {'num_interpreters': count, 'threads_per_interpreter': threads_per_interpreter,
+               'dispatch': dispatch, 'frames': frames * shape[0], 'seconds': seconds,
+               'frames_per_s': frames * shape[0] / seconds}
+        row['speedup'] = row['frames_per_s'] / rows[0]['frames_per_s'] if rows else 1.0
+        print(row)
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='.tflite model filepath')
+    parser.add_argument('--shape', nargs=4, type=int, default=[1, 512, 512, 1], help='B H W C input shape')
+    parser.add_argument('--frames', type=int, default=200, help='batches per configuration')
+    parser.add_argument('--counts', nargs='+', type=int, default=None, help='interpreter counts, defaults to 1 up to all cores')
+    parser.add_argument('--threads', type=int, default=1, help='threads per interpreter')
+    parser.add_argument('--dispatch', choices=DISPATCH_MODES, default='least_loaded')
+    parser.add_argument('--out', default=None, help='.csv or .json results filepath')
+    args = parser.parse_args()
+
+    results = benchmark_scaling(args.model, tuple(args.shape), args.frames, args.counts, args.threads, args.dispatch)
+    if args.out and args.out.endswith('.json'):
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif args.out:
+        with open(args.out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=_FIELDNAMES)
+            writer.writeheader()
+            writer.writerows(results)
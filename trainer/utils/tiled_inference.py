@@ -0,0 +1,118 @@
+""" Tiled inference with overlap blending for frames too large to run in one shot.
+
+    predictor = TiledPredictor(keras_predict_fn(model), memory_budget_mb=256)
+    output = predictor(das)  # [H, W] or [H, W, 1] in, [H, W, 1] out
+"""
+
+import numpy as np
+
+
+def receptive_field(levels=5, kernel_size=3, convs_per_level=2):
+    """Receptive field in pixels of a MimickNet_Conv / MimickNet_SepConv U-Net"""
+    field = 1
+    # Encoder convs and max pools, bottleneck included
+    for level in range(levels):
+        field += convs_per_level * (kernel_size - 1) * 2**level
+        if level != levels - 1:
+            field += 2**level
+    # Decoder convs after each upsampling
+    for level in reversed(range(levels - 1)):
+        field += convs_per_level * (kernel_size - 1) * 2**level
+    return field
+
+
+def activation_bytes(tile_size, levels=5, filters=16):
+    """Rough float32 activation footprint of one tile: per level, two conv outputs, the skip and the concatenation"""
+    return sum(4 * 4 * filters * (tile_size // 2**level)**2 for level in range(levels))
+
+
+def window_1d(size, overlap, margin, ramp_start=True, ramp_end=True):
+    """Blend weights along one tile axis. Interior edges ignore the first margin pixels, which see
+    the tile border within the receptive field, then cross-fade linearly over the rest of the overlap."""
+    position = np.arange(size) + 0.5
+    ramp = np.clip((position - margin) / max(overlap - 2*margin, 1), 0, 1)
+    window = np.ones(size, dtype=np.float32)
+    if ramp_start:
+        window = np.minimum(window, ramp)
+    if ramp_end:
+        window = np.minimum(window, ramp[::-1])
+    return window.astype(np.float32)
+
+
+def tile_starts(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    return starts + [length - tile_size]
+
+
+class TiledPredictor():
+    def __init__(self, predict_fn, tile_size=None, overlap=None, batch_size=4, memory_budget_mb=None,
+                 levels=5, kernel_size=3, filters=16):
+        self.predict_fn = predict_fn
+        self.divisor = 2**(levels - 1)
+        # Pixels closer than half the receptive field to a tile border differ from a full-frame run
+        self.margin = receptive_field(levels, kernel_size) // 2
+        self.overlap = overlap if overlap is not None else 2*self.margin + self.divisor
+        self.overlap = int(np.ceil(self.overlap / self.divisor) * self.divisor)
+        self.margin = min(self.margin, self.overlap // 2)
+
+        if tile_size is None:
+            tile_size = 512
+            if memory_budget_mb is not None:
+                budget = memory_budget_mb * 2**20
+                tile_size = 2 * self.overlap + self.divisor
+                required = activation_bytes(tile_size, levels, filters)
+                if required > budget:
+                    raise ValueError('memory_budget_mb {} is below the {:.0f} MB a single {}px tile needs'.format(
+                        memory_budget_mb, required / 2**20, tile_size))
+                # Smaller batches before smaller tiles, the smallest tile is mostly overlap
+                batch_size = int(min(batch_size, budget // required))
+                while batch_size * activation_bytes(tile_size + self.divisor, levels, filters) <= budget:
+                    tile_size += self.divisor
+        if tile_size % self.divisor or tile_size <= self.overlap:
+            raise ValueError('tile_size must be a multiple of {} larger than the overlap {}'.format(self.divisor, self.overlap))
+        self.tile_size = tile_size
+        self.batch_size = batch_size
+
+    def __call__(self, image):
+        image = np.asarray(image, dtype=np.float32)
+        if image.ndim == 3:
+            image = image[..., 0]
+        height, width = image.shape
+
+        # Reflect pad only to the pooling grid, so every tile start stays aligned with it. An axis shorter
+        # than a tile gets a tile of its own length, padding it further would put mirrored content where
+        # a one-shot run sees the model's zero padding.
+        pad_h = -(-height // self.divisor) * self.divisor - height
+        pad_w = -(-width // self.divisor) * self.divisor - width
+        padded = np.pad(image, [[0, pad_h], [0, pad_w]], mode='reflect')
+        tile_h = min(self.tile_size, padded.shape[0])
+        tile_w = min(self.tile_size, padded.shape[1])
+        rows = tile_starts(padded.shape[0], tile_h, tile_h - self.overlap)
+        cols = tile_starts(padded.shape[1], tile_w, tile_w - self.overlap)
+        boxes = [(y, x) for y in rows for x in cols]
+
+        output = np.zeros(padded.shape, dtype=np.float32)
+        weights = np.zeros(padded.shape, dtype=np.float32)
+        for i in range(0, len(boxes), self.batch_size):
+            batch_boxes = boxes[i:i + self.batch_size]
+            batch = np.stack([padded[y:y + tile_h, x:x + tile_w] for y, x in batch_boxes])[..., None]
+            predictions = np.asarray(self.predict_fn(batch))[..., 0]
+            for (y, x), prediction in zip(batch_boxes, predictions):
+                # Frame borders are real borders, only edges shared with another tile are blended
+                window = np.outer(window_1d(tile_h, self.overlap, self.margin, y != rows[0], y != rows[-1]),
+                                  window_1d(tile_w, self.overlap, self.margin, x != cols[0], x != cols[-1]))
+                output[y:y + tile_h, x:x + tile_w] += prediction * window
+                weights[y:y + tile_h, x:x + tile_w] += window
+
+        return (output / weights)[:height, :width, None]
+
+
+def keras_predict_fn(model):
+    return lambda batch: model.predict_on_batch(batch)
+
+
+def tflite_predict_fn(interpreter):
+    from utils.tflite import run_tflite
+    return lambda batch: run_tflite(interpreter, batch)
@@ -0,0 +1,85 @@
+import time
+import numpy as np
+import tensorflow as tf
+from utils.metrics import fused_metrics
+
+_METRICS = ['mae', 'mse', 'ssim', 'psnr']
+
+class Trainer():
+    """Hand-written alternative to model.fit for the MAE-trained MimickNet models.
+
+    The forward, backward and metric pass is one XLA compiled function. The loss and the
+    mae / mse / ssim / psnr metrics all come from a single fused_metrics pass. With accum_steps > 1
+    gradients of that many batches are summed before one optimizer update, for large effective batches."""
+    def __init__(self, model, optimizer, accum_steps=1, jit_compile=True):
+        self.model = model
+        self.optimizer = optimizer
+        self.accum_steps = accum_steps
+        self.loss_scale = isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer)
+        self.metrics = {key: tf.keras.metrics.Mean(key) for key in _METRICS}
+        self.val_metrics = {key: tf.keras.metrics.Mean('val_' + key) for key in _METRICS}
+        self.accumulators = [tf.Variable(tf.zeros_like(v), trainable=False) for v in model.trainable_variables]
+        self.compute_step = tf.function(self._compute_step, jit_compile=jit_compile)
+        self.val_step = tf.function(self._val_step, jit_compile=jit_compile)
+        self.apply_step = tf.function(self._apply_step)
+
+    def _compute_step(self, x, y):
+        with tf.GradientTape() as tape:
+            y_pred = self.model(x, training=True)
+            metrics = fused_metrics(y, y_pred, 1)
+            loss = tf.reduce_mean(metrics['mae'])
+            scaled_loss = self.optimizer.get_scaled_loss(loss) if self.loss_scale else loss
+        gradients = tape.gradient(scaled_loss, self.model.trainable_variables)
+        if self.loss_scale:
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+        for key, metric in self.metrics.items():
+            metric.update_state(metrics[key])
+        if self.accum_steps == 1:
+            return gradients
+        for accumulator, gradient in zip(self.accumulators, gradients):
+            accumulator.assign_add(gradient / self.accum_steps)
+        return []
+
+    def _apply_step(self, gradients):
+        if not gradients:
+            gradients = [accumulator.read_value() for accumulator in self.accumulators]
+            for accumulator in self.accumulators:
+                accumulator.assign(tf.zeros_like(accumulator))
+        self.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+
+    def _val_step(self, x, y):
+        metrics = fused_metrics(y, self.model(x, training=False), 1)
+        for key, metric in self.val_metrics.items():
+            metric.update_state(metrics[key])
+
+    def fit(self, train_dataset, steps_per_epoch, epochs=1, validation_data=None, validation_steps=None, skip_steps=5):
+        """Steps count batches, every accum_steps batches make one optimizer update. Returns a model.fit like history."""
+        history = {}
+        train_iterator = iter(train_dataset)
+        for epoch in range(epochs):
+            for metric in list(self.metrics.values()) + list(self.val_metrics.values()):
+                metric.reset_state()
+            step_times = []
+            for step in range(steps_per_epoch):
+                t_start = time.perf_counter()
+                x, y = next(train_iterator)
+                gradients = self.compute_step(x, y)
+                if (step + 1) % self.accum_steps == 0:
+                    self.apply_step(gradients)
+                # Waiting on one scalar keeps step times honest, full results only leave the device once per epoch
+                self.metrics['mae'].result().numpy()
+                step_times.append(time.perf_counter() - t_start)
+
+            if validation_data is not None:
+                for x, y in validation_data.take(validation_steps):
+                    self.val_step(x, y)
+
+            # The first steps include tracing and XLA compilation
+            logs = {key: float(metric.result()) for key, metric in self.metrics.items()}
+            if validation_data is not None:
+                logs.update({'val_' + key: float(metric.result()) for key, metric in self.val_metrics.items()})
+            logs['step_ms'] = float(np.median(step_times[skip_steps:] or step_times) * 1000)
+            print('Epoch {}/{} - '.format(epoch + 1, epochs) + ' - '.join('{}: {:.4f}'.format(k, v) for k, v in logs.items()))
+            for key, value in logs.items():
+                history.setdefault(key, []).append(value)
+        return history